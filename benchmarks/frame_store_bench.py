@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""RAM vs. window-read throughput of CompressedFrameStore against a plain in-memory frame array
+
+run from the repo root:
+    python benchmarks/frame_store_bench.py
+    python benchmarks/frame_store_bench.py --env_name FlappyBirdDay-v0
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from data.frame_store import CompressedFrameStore
+
+
+def synthetic_frames(num_frames, resize_to, seed=0):
+    # static textured background plus a moving sprite, roughly what game frames look like
+    rng = np.random.RandomState(seed)
+    h, w = resize_to
+    background = np.repeat(rng.randint(0, 255, size=(h // 8, w // 8, 3), dtype=np.uint8), 8, axis=0)
+    background = np.repeat(background, 8, axis=1)[:h, :w]
+    frames = np.repeat(background[None], num_frames, axis=0)
+    ys = (np.arange(num_frames) * 3) % (h - 16)
+    xs = (np.arange(num_frames) * 5) % (w - 16)
+    for i in range(num_frames):
+        frames[i, ys[i]:ys[i] + 16, xs[i]:xs[i] + 16] = 255
+    return frames
+
+
+def env_frames(env_name, num_frames, resize_to):
+    from data.datasets import EnvDataset, EpisodeCorpus
+    corpus = EpisodeCorpus(env_name=env_name, max_frames=500, resize_to=resize_to)
+    ds = EnvDataset(corpus=corpus, total_frames=num_frames, frames_per_example=1)
+    return np.concatenate([ep.frames for ep in ds.datasets])
+
+
+def windows_per_sec(frames, frames_per_example, num_reads, seed=0):
+    rng = np.random.RandomState(seed)
+    starts = rng.randint(len(frames) - frames_per_example, size=num_reads)
+    t0 = time.time()
+    for start in starts:
+        # copy the window out, a plain array slice alone would only make a view
+        window = np.array(frames[start:start + frames_per_example])
+    return num_reads / (time.time() - t0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_name", type=str, default=None)
+    parser.add_argument("--num_frames", type=int, default=5000)
+    parser.add_argument("--resize_to", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--frames_per_example", type=int, default=10)
+    parser.add_argument("--num_reads", type=int, default=5000)
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--cache_mbs", type=int, nargs="+", default=[8, 64, 256])
+    args = parser.parse_args()
+
+    resize_to = tuple(args.resize_to)
+    if args.env_name is None:
+        frames = synthetic_frames(args.num_frames, resize_to)
+    else:
+        frames = env_frames(args.env_name, args.num_frames, resize_to)
+
+    print("%-28s %12s %14s" % ("store", "RAM (MB)", "windows/sec"))
+    rate = windows_per_sec(frames, args.frames_per_example, args.num_reads)
+    print("%-28s %12.1f %14.0f" % ("np.stack array", frames.nbytes / 2**20, rate))
+    for chunk_size in args.chunk_sizes:
+        t0 = time.time()
+        store = CompressedFrameStore(frames, chunk_size=chunk_size, cache_mb=max(args.cache_mbs))
+        compress_time = time.time() - t0
+        for cache_mb in args.cache_mbs:
+            store.cache_bytes = cache_mb * 2**20
+            store._reset_cache()
+            rate = windows_per_sec(store, args.frames_per_example, args.num_reads)
+            ram = (store.nbytes + min(store._cache_nbytes, store.cache_bytes)) / 2**20
+            print("%-28s %12.1f %14.0f" % ("chunk=%i cache=%iMB" % (chunk_size, cache_mb), ram, rate))
+        print("\t(compressing took %.2fs, ratio %.1fx)" % (compress_time, frames.nbytes / store.nbytes))
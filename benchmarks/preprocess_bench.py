@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""throughput of batched preprocess_frames against the per-frame PIL convert_frame path,
+and how far apart their outputs are
+
+run from the repo root:
+    python benchmarks/preprocess_bench.py
+    python benchmarks/preprocess_bench.py --src_hw 224 320 --batch_sizes 1 32 256
+"""
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from data.utils import pil_convert_frame
+from data.preprocess import preprocess_frames
+
+
+def frames_per_sec(fn, frames, repeats):
+    fn(frames) # warm up, also builds the interpolation weights
+    t0 = time.time()
+    for _ in range(repeats):
+        fn(frames)
+    return repeats * len(frames) / (time.time() - t0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src_hw", type=int, nargs=2, default=[210, 160]) # atari frame
+    parser.add_argument("--resize_to", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 10, 64, 256])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+    resize_to = tuple(args.resize_to)
+
+    rng = np.random.RandomState(0)
+    # smooth frames, so the comparison isn't dominated by resampling white noise
+    frames = rng.randint(0, 255, size=(max(args.batch_sizes), args.src_hw[0] // 8, args.src_hw[1] // 8, 3))
+    frames = np.repeat(np.repeat(frames, 8, axis=1), 8, axis=2).astype(np.uint8)
+
+    pil_out = torch.stack([pil_convert_frame(f, resize_to=resize_to, to_tensor=True) for f in frames])
+    out = preprocess_frames(frames, resize_to=resize_to, to_tensor=True).cpu()
+    print("max abs diff vs PIL (normalized units): %.4f, mean: %.5f" % ((out - pil_out).abs().max(),
+                                                                         (out - pil_out).abs().mean()))
+    pil_u8 = np.stack([pil_convert_frame(f, resize_to=resize_to) for f in frames]).astype(np.int32)
+    u8 = preprocess_frames(frames, resize_to=resize_to, to_tensor=False).astype(np.int32)
+    print("max abs diff vs PIL (uint8 levels): %i" % np.abs(u8 - pil_u8).max())
+
+    pil_fn = lambda fs: torch.stack([pil_convert_frame(f, resize_to=resize_to, to_tensor=True,
+                                                        device=args.device) for f in fs])
+    batched_fn = lambda fs: preprocess_frames(fs, resize_to=resize_to, to_tensor=True, device=args.device)
+    print("%-10s %16s %16s %8s" % ("batch", "PIL frames/sec", "batched fr/sec", "speedup"))
+    for batch_size in args.batch_sizes:
+        fs = frames[:batch_size]
+        pil_rate = frames_per_sec(pil_fn, fs, args.repeats)
+        batched_rate = frames_per_sec(batched_fn, fs, args.repeats)
+        print("%-10i %16.0f %16.0f %7.1fx" % (batch_size, pil_rate, batched_rate, batched_rate / pil_rate))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""forward+backward time of Encoder.encode_sequence (one pass over B*T frames) against
+calling the encoder once per frame, as InverseModel, TDC and ShuffleNLearn used to
+
+run from the repo root:
+    python benchmarks/sequence_encode_bench.py
+"""
+import sys
+import time
+import argparse
+import torch
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from models.base_encoder import Encoder
+
+
+def per_frame(encoder, xs):
+    return torch.stack([encoder(xs[:,i]) for i in range(xs.shape[1])], dim=1)
+
+def fused(encoder, xs):
+    return encoder.encode_sequence(xs)
+
+def step_time(encode_fn, encoder, xs, repeats):
+    encode_fn(encoder, xs).sum().backward() # warm up
+    t0 = time.time()
+    for _ in range(repeats):
+        encoder.zero_grad()
+        encode_fn(encoder, xs).sum().backward()
+    return (time.time() - t0) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--frames_per_example", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--resize_to", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    encoder = Encoder(im_wh=tuple(args.resize_to)).to(args.device)
+    print("%-6s %14s %14s %8s %10s" % ("T", "per-frame (s)", "fused (s)", "speedup", "max diff"))
+    for num_frames in args.frames_per_example:
+        xs = torch.randn(args.batch_size, num_frames, 3, *args.resize_to).to(args.device)
+        diff = float((per_frame(encoder, xs) - fused(encoder, xs)).abs().max())
+        t_loop = step_time(per_frame, encoder, xs, args.repeats)
+        t_fused = step_time(fused, encoder, xs, args.repeats)
+        print("%-6i %14.4f %14.4f %7.2fx %10.2e" % (num_frames, t_loop, t_fused, t_loop / t_fused, diff))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""peak memory and step time of ShuffleNLearn.loss_acc against the old deepcopy/stack shuffle
+
+Each variant runs in a fresh process so ru_maxrss (or max_memory_allocated on gpu) only
+sees that variant. Run from the repo root:
+    python benchmarks/snl_shuffle_bench.py
+"""
+import sys
+import time
+import copy
+import argparse
+import resource
+import multiprocessing as mp
+import torch
+from torch import nn
+from argparse import Namespace
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from models.shuffle_n_learn import ShuffleNLearn
+from data.utils import Transition
+
+
+def old_loss_acc(model, trans):
+    # ShuffleNLearn.shuffle/loss_acc before frames were shuffled as embeddings
+    xs = copy.deepcopy(trans.xs)
+    batch_size = xs.shape[0]
+    ind = torch.linspace(0,xs.shape[1] - 1,steps=5).round().long()
+    x_subsampled = torch.index_select(input=xs,dim=1,index=ind)
+    a,b,c,d,e = [x_subsampled[:,i] for i in range(5)]
+    bcd = copy.deepcopy(torch.stack((b,c,d)))
+    bad = copy.deepcopy(torch.stack((b,a,d)))
+    bed = copy.deepcopy(torch.stack((b,e,d)))
+    bcdbadbed = torch.stack((bcd,bad,bed))
+    probs = torch.tensor([0.5,0.25,0.25])
+    inds = torch.multinomial(input=probs, num_samples=batch_size, replacement=True)
+    x_shuff = torch.stack([bcdbadbed[inds[i],:,i] for i in range(batch_size) ])
+    true = (inds < 1).long().to(xs.device)
+    # the old per-frame forward, model.forward now runs the fused encode_sequence
+    f = torch.cat([model.encoder(x_shuff[:,i]) for i in range(x_shuff.shape[1])], dim=1)
+    pred = model.bin_clsf(f)
+    return nn.CrossEntropyLoss()(pred,true), None
+
+def new_loss_acc(model, trans):
+    return model.loss_acc(trans)
+
+
+def run(variant, args, result_queue):
+    model_args = Namespace(stride=1, frames_per_example=args.num_frames, device=args.device)
+    model = ShuffleNLearn(im_wh=tuple(args.resize_to), args=model_args).to(args.device)
+    xs = torch.randn(args.batch_size, args.num_frames, 3, *args.resize_to).to(args.device)
+    trans = Transition(xs=xs, actions=None, state_param_dict={})
+    loss_acc = dict(old=old_loss_acc, new=new_loss_acc)[variant]
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.device == "cuda":
+        torch.cuda.reset_max_memory_allocated()
+    t0 = time.time()
+    for _ in range(args.repeats):
+        model.zero_grad()
+        loss, _ = loss_acc(model, trans)
+        loss.backward()
+    step_time = (time.time() - t0) / args.repeats
+    if args.device == "cuda":
+        peak_mb = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0) / 2**10
+    result_queue.put((step_time, peak_mb))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--num_frames", type=int, default=10)
+    parser.add_argument("--resize_to", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print("%-8s %14s %18s" % ("shuffle", "step time (s)", "peak mem +MB"))
+    for variant in ["old", "new"]:
+        result_queue = ctx.Queue()
+        p = ctx.Process(target=run, args=(variant, args, result_queue))
+        p.start()
+        step_time, peak_mb = result_queue.get()
+        p.join()
+        print("%-8s %14.4f %18.1f" % (variant, step_time, peak_mb))
@@ -1,6 +1,6 @@
 import numpy as np
 import copy
-from data.utils import convert_frame, convert_frames
+from data.utils import convert_frame
 from functools import partial
 from torchvision.transforms import ToTensor,Compose,Resize,Normalize
 from torchvision.datasets import ImageFolder
@@ -9,9 +9,19 @@ from pathlib import Path
 from torch.utils.data import Dataset, ConcatDataset
 import torch
 from collections import defaultdict
-from data.utils import appendabledict
+from multiprocessing import Pool
+from data.utils import appendabledict, derive_seed, EpisodeBuffer
+from data.env_utils.env_setup import setup_env, seed_env
+from data.env_utils.get_state_params import get_label_dict
+from data.episode_cache import EpisodeCache
+from data.frame_store import CompressedFrameStore
+from data.shared import share_array, to_shared_ref, from_shared_ref
 
 class EpisodeDataset(Dataset):
+    """window view over one episode: example i is frames_per_example frames starting at
+    frame i, stride frames apart. Built with an env it collects the episode itself,
+    otherwise it wraps an already collected (frames, actions, label_dict) episode,
+    which only costs an index range, so many views can share one episode."""
     
     def __init__(self,
                  env,
@@ -19,7 +29,9 @@ class EpisodeDataset(Dataset):
                  max_frames=-1, 
                  resize_to=(-1,-1),
                  stride =1,
-                 policy=None):
+                 policy=None,
+                 seed=None,
+                 episode=None):
         
         self.convert_fxn = partial(convert_frame, resize_to=resize_to)
         #self.args = args
@@ -28,9 +40,18 @@ class EpisodeDataset(Dataset):
         self.resize_to = resize_to
         self.policy = policy
         self.frames_per_example = frames_per_example
-        self.max_frames = max_frames + (frames_per_example * stride)  if max_frames != -1 else np.inf
-        self.frames, self.actions, self.label_dict = self.collect_episode()
-        self.inds = range(len(self.frames) - (self.frames_per_example * stride)) 
+        # max_frames caps the raw episode length, so the episode doesn't depend on the window size
+        self.max_frames = max_frames if max_frames != -1 else np.inf
+        if episode is None:
+            if seed is not None:
+                seed_env(self.env, seed)
+            episode = self.collect_episode()
+        # the env is only needed for collecting, don't drag it into DataLoader workers
+        self.env = None
+        # episode can also be handed in already collected, e.g. by a collection worker
+        self.frames, self.actions, self.label_dict = episode
+        # a window spans (frames_per_example - 1) * stride + 1 frames
+        self.inds = range(max(len(self.frames) - (self.frames_per_example - 1) * stride, 0))
         
     def _step(self):
         if self.policy:
@@ -42,62 +63,202 @@ class EpisodeDataset(Dataset):
         
            
     def collect_episode(self):
-        label_dict = appendabledict(list)
+        # the buffer starts small and doubles as needed, up to max_frames rows
+        buf = EpisodeBuffer(capacity=256, max_rows=self.max_frames)
         
         done = False
         obs, info = self.env.reset()
         frame = self.convert_fxn(self.env.render("rgb_array"))
-
-        label_dict.append_update(info)
-        frames = [frame]
-        actions = []
+        buf.append_frame(frame, info)
         
         frame_count = 1
         while not done and frame_count < self.max_frames:
             action = self._step()
             obs, reward, done, info = self.env.step(action) 
             frame = self.env.render("rgb_array")
-            label_dict.append_update(info)
             frame = self.convert_fxn(frame)
-            frames.append(frame)
-            actions.append(action)
+            buf.append_frame(frame, info)
+            buf.append_action(action)
             frame_count += 1
             
-            
-        for k,v in label_dict.items():
-            label_dict[k] = np.stack(v)
-
-        return np.stack(frames), np.stack(actions), label_dict
+        # frames stay uint8 (N,H,W,3) from here on, they are only normalized per batch in collate_transitions
+        return buf.get_episode()
     
     def __getitem__(self, index):
         ind = self.inds[index]
         end_ind = ind + (self.frames_per_example * self.stride)
-        action_end_ind = end_ind - 1
         slice_ = slice(ind,end_ind, self.stride)
-        #action_slice_ = slice(ind,action_end_ind, self.stride)
-        frames = self.frames[slice_]
-        frames =  convert_frames(frames, resize_to=self.resize_to, to_tensor=True)
-        frames = frames.transpose(0,1)
-        #actions = self.actions[action_slice_]
+        # the action taken right after each frame of the window but the last one
+        action_slice_ = slice(ind,end_ind - self.stride, self.stride)
+        frames = self.frames[slice_] # strided uint8 view, no copy
+        actions = self.actions[action_slice_]
         labels = self.label_dict.subslice(slice_)
-        return frames,labels # actions #, labels
+        return frames, actions, labels
 
     def __len__(self):
         return len(self.inds)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["frames"] = to_shared_ref(self.frames)
+        state["actions"] = to_shared_ref(self.actions)
+        state["label_dict"] = {k: to_shared_ref(v) for k, v in self.label_dict.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = from_shared_ref(self.frames)
+        self.actions = from_shared_ref(self.actions)
+        label_dict = appendabledict(list)
+        for k, v in state["label_dict"].items():
+            label_dict[k] = from_shared_ref(v)
+        self.label_dict = label_dict
+
+    def truncate(self, num_examples):
+        self.inds = self.inds[:num_examples]
+
     def __add__(self, other):
         return ConcatDataset([self, other])
     
         
+class EpisodeCorpus(object):
+    """the raw episodes of one env, level and seed, collected once and shared by every
+    window view (frames_per_example, stride) built on top of it
+
+    Episode i is always collected with the seed derive_seed(seed, i), so the corpus is
+    identical for a given seed whatever num_collect_workers is. With num_collect_workers > 0
+    missing episodes are collected on a pool of processes, each holding its own env.
+    If cache_dir is given, episodes already in the EpisodeCache are loaded memory-mapped
+    and only the missing ones are collected. frame_store (CompressedFrameStore kwargs)
+    keeps every episode's frames compressed. share_dir puts episodes that are not
+    already memory-mapped from the cache into memory-mapped files there, so DataLoader
+    workers don't each copy the dataset.
+    Episodes are collected (and cached) with the raw state columns the env wrapper
+    records and the bucketed labels are derived from them with num_buckets on load,
+    so changing the buckets or adding a label never needs a new collection.
+    """
+    def __init__(self, env_name, level="None", seed=0, max_frames=-1, resize_to=(-1,-1), num_buckets=16,
+                 num_collect_workers=0, cache_dir=None, frame_store=None, share_dir=None):
+        self.env_name, self.level = env_name, level
+        self.num_buckets = num_buckets
+        self.seed = seed
+        self.max_frames = max_frames
+        self.collect_kwargs = dict(max_frames=max_frames, resize_to=resize_to)
+        self.num_collect_workers = num_collect_workers
+        self.frame_store = frame_store
+        self.share_dir = share_dir
+        self.episodes = []
+        self.pool = None
+        self.env = None
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = EpisodeCache(cache_dir,
+                                      env_name=env_name,
+                                      level=level,
+                                      seed=seed,
+                                      max_frames=max_frames,
+                                      resize_to=list(resize_to),
+                                      columns="raw_state")
+
+    def round_size(self, num_missing_examples):
+        max_frames = self.max_frames if self.max_frames > 0 else np.inf
+        # one episode per collect worker at least, determinism comes from derive_seed, not the round size
+        return max(int(np.ceil(num_missing_examples / max_frames)), max(self.num_collect_workers, 1))
+
+    def get_episodes(self, inds):
+        """returns episodes inds, collecting (or loading from the cache) the ones not seen yet"""
+        num_needed = max(inds) + 1
+        if num_needed > len(self.episodes):
+            new_inds = range(len(self.episodes), num_needed)
+            cached = [i for i in new_inds if self.cache is not None and self.cache.has(i)]
+            to_collect = [i for i in new_inds if i not in cached]
+            jobs = [(derive_seed(self.seed, i), self.collect_kwargs) for i in to_collect]
+            collected = dict(zip(to_collect, self.map_collect(jobs))) if jobs else {}
+            for i in new_inds:
+                if self.cache is not None:
+                    if i in collected:
+                        self.cache.save(i, collected[i])
+                    episode = self.cache.load(i)
+                else:
+                    episode = collected[i]
+                self.episodes.append(self.process(episode))
+        return [self.episodes[i] for i in inds]
+
+    def process(self, episode):
+        frames, actions, raw = episode
+        label_dict = appendabledict(list, get_label_dict(self.env_name, raw, self.num_buckets))
+        if self.frame_store is not None:
+            frames = CompressedFrameStore(frames, **self.frame_store)
+        if self.share_dir is not None:
+            if not isinstance(frames, CompressedFrameStore):
+                frames = share_array(frames, self.share_dir)
+            actions = share_array(actions, self.share_dir)
+            for k, v in label_dict.items():
+                label_dict[k] = share_array(v, self.share_dir)
+        return frames, actions, label_dict
+
+    def map_collect(self, jobs):
+        # envs are only built once something actually has to be collected
+        if self.num_collect_workers > 0:
+            if self.pool is None:
+                self.pool = Pool(self.num_collect_workers,
+                                 initializer=_init_collect_worker,
+                                 initargs=(self.env_name, self.level))
+            return self.pool.map(_collect_worker_episode, jobs, chunksize=1)
+        else:
+            if self.env is None:
+                self.env = setup_env(self.env_name, level=self.level)
+            return [_collect_episode(self.env, job) for job in jobs]
+
+    def close_collectors(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.env is not None:
+            self.env.close()
+            self.env = None
+
+
 class EnvDataset(ConcatDataset):
-    def __init__(self, total_frames, **kwargs):
-        max_frames = kwargs["max_frames"]
-        num_episodes = total_frames // max_frames
-        episodes = [ EpisodeDataset(**kwargs  ) for _ in range(num_episodes )]
-        
-        num_frames = sum([len(ep) for ep in episodes])
-        while num_frames  < total_frames:
-            kwargs["max_frames"] = total_frames - num_frames
-            episodes.append(EpisodeDataset(**kwargs))
-            num_frames = sum([len(ep) for ep in episodes])
-        super(EnvDataset,self).__init__(episodes)
\ No newline at end of file
+    """total_frames examples of frames_per_example frames, stride apart, taken from the
+    episodes of corpus in order. The last episode used is truncated, so the same corpus
+    serves any window size and only grows when a view needs more episodes than it has."""
+    def __init__(self, corpus, total_frames, frames_per_example=5, stride=1):
+        episodes = []
+        num_frames = 0
+        try:
+            while num_frames < total_frames:
+                round_size = corpus.round_size(total_frames - num_frames)
+                num_frames_before = num_frames
+                inds = range(len(episodes), len(episodes) + round_size)
+                for episode in corpus.get_episodes(inds):
+                    ep = EpisodeDataset(env=None, episode=episode,
+                                        frames_per_example=frames_per_example, stride=stride)
+                    if num_frames + len(ep) >= total_frames:
+                        ep.truncate(total_frames - num_frames)
+                    episodes.append(ep)
+                    num_frames += len(ep)
+                    if num_frames >= total_frames:
+                        break
+                if num_frames == num_frames_before:
+                    raise ValueError("%i episodes in a row were too short for a window of %i frames %i apart, "
+                                     "is episode_max_frames too small?" % (round_size, frames_per_example, stride))
+        finally:
+            corpus.close_collectors()
+        super(EnvDataset,self).__init__(episodes)
+
+
+_collect_env = None
+
+def _init_collect_worker(env_name, level):
+    global _collect_env
+    _collect_env = setup_env(env_name, level=level)
+
+def _collect_worker_episode(job):
+    return _collect_episode(_collect_env, job)
+
+def _collect_episode(env, job):
+    seed, kwargs = job
+    ep = EpisodeDataset(env=env, seed=seed, **kwargs)
+    return ep.frames, ep.actions, ep.label_dict
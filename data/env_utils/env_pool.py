@@ -0,0 +1,59 @@
+import os
+import atexit
+from multiprocessing import util
+from collections import defaultdict
+from contextlib import contextmanager
+from data.env_utils.env_setup import setup_env, seed_env
+
+
+class EnvPool(object):
+    """wrapped envs kept alive and reused between episodes, keyed by (env_name, level)
+
+    Making an env (loading a PLE game or a retro ROM) can cost more than a short episode,
+    and retro only allows one emulator per process, so rollouts check an env out, reset it,
+    and hand it back instead of making a new one each time. close_all closes every env made.
+    """
+    def __init__(self):
+        self.free = defaultdict(list)
+        self.envs = []
+
+    @contextmanager
+    def checkout(self, env_name, level="None", seed=None):
+        """yields an env of env_name/level that nobody else is using, seeded with seed if it's given.
+        The caller resets it"""
+        key = (env_name, level)
+        if self.free[key]:
+            env = self.free[key].pop()
+        else:
+            env = setup_env(env_name, level=level)
+            self.envs.append(env)
+        if seed is not None:
+            seed_env(env, seed)
+        try:
+            yield env
+        finally:
+            self.free[key].append(env)
+
+    def close_all(self):
+        for env in self.envs:
+            env.close()
+        self.envs = []
+        self.free.clear()
+
+
+_env_pools = {}
+
+def get_env_pool():
+    """the env pool of this process, closed when the process exits"""
+    pid = os.getpid()
+    if pid not in _env_pools:
+        _env_pools[pid] = EnvPool()
+        atexit.register(_close_env_pool, pid)
+        # multiprocessing workers leave through os._exit, which skips atexit but runs finalizers
+        util.Finalize(None, _close_env_pool, args=(pid,), exitpriority=0)
+    return _env_pools[pid]
+
+def _close_env_pool(pid):
+    # forked children inherit the atexit hook, only the owner closes its envs
+    if os.getpid() == pid and pid in _env_pools:
+        _env_pools.pop(pid).close_all()
@@ -7,13 +7,24 @@ import retro
 from data.env_utils import wrappers
 
         
-def setup_env(env_name, seed=0):
+def setup_env(env_name, level="None", seed=0):
     gym_mod = get_gym_module(env_name)
-    env = gym_mod.make(env_name)
-    env.seed(seed)
+    if gym_mod is retro and level != "None":
+        env = gym_mod.make(env_name, state=level)
+    else:
+        env = gym_mod.make(env_name)
     wrapper = get_wrapper(env, env_name)
     env = wrapper(env)
+    seed_env(env, seed)
     return env
+
+def seed_env(env, seed):
+    env.seed(seed)
+    if hasattr(env.action_space, "seed"):
+        env.action_space.seed(seed)
+    else: # older gym samples every action space from one module level RandomState
+        from gym.spaces import prng
+        prng.seed(seed)
     
         
 def get_wrapper(env, env_name):
@@ -36,4 +47,4 @@ def get_env_type(env, env_name):
     
     else:
         env_type = env_name.split("-")[0]
-    return env_type
\ No newline at end of file
+    return env_type
@@ -1,178 +1,84 @@
-from PIL import Image
-from torchvision.transforms import Compose, Normalize, Resize, ToTensor, Grayscale
 import numpy as np
-# from ple import gym_ple
-# import gym
-import torch
-from functools import partial
-import math
 
 def bucket_coord(coord, num_buckets, max_coord, min_coord=0):
-    try:
-        assert (coord < max_coord and coord >= min_coord)
-    except:
-        print("coord: %i, max: %i, min: %i, num_buckets: %i"%(coord, max_coord, min_coord,num_buckets))
-        assert False, coord
-        #coord = 0
+    """buckets a coordinate or a whole array of them at once"""
+    coord = np.asarray(coord)
+    out_of_range = (coord >= max_coord) | (coord < min_coord)
+    if np.any(out_of_range):
+        bad = coord[out_of_range] if coord.ndim > 0 else coord
+        print("coords: %s, max: %s, min: %s, num_buckets: %i"%(bad, max_coord, min_coord, num_buckets))
+        assert False, bad
     coord_range = (max_coord - min_coord) + 1
     thresh =  coord_range/num_buckets
     bucketed_coord =  np.floor((coord - min_coord) /thresh)
     return bucketed_coord
 
 
-def sonic_get_latent_dict(env):
-    
-    y = env.env.data.lookup_value("y")
-    screen_y = env.env.data.lookup_value("screen_y")
-    x = env.env.data.lookup_value("x")
-    screen_x = env.env.data.lookup_value("screen_x")
-    x_coord = bucket_coord(x - screen_x,env.num_buckets,200)
-    y_coord = bucket_coord(y - screen_y,env.num_buckets,220)
-    latent_dict = dict(x_coord=x_coord,y_coord=y_coord)
-    return latent_dict
+# labels derived after collection from the raw state columns the wrappers record,
+# each function works on a whole episode (or several) of columns at once
 
-def sonic_get_nclasses_table(env):
-    return dict(x_coord=env.num_buckets,
-                y_coord=env.num_buckets)
+ATARI_SCREEN_WIDTH = 160
+FLAPPYBIRD_HEIGHT = 512
+FLAPPYBIRD_MAX_PIPE_DIST = 305
 
-def lunarlander_get_latent_dict(env):
-    x,y = env.env.lander.position
-    x_coord = bucket_coord(coord=x, num_buckets=env.num_buckets, max_coord=20.5)
-    y_coord = bucket_coord(coord=y, num_buckets=env.num_buckets, max_coord=13.7)
-    latent_dict = dict(x_coord=x_coord,y_coord=y_coord)
-    return latent_dict
+def sonic_get_label_dict(raw, num_buckets, env_name):
+    x_coord = bucket_coord(raw["x"] - raw["screen_x"], num_buckets, 200)
+    y_coord = bucket_coord(raw["y"] - raw["screen_y"], num_buckets, 220)
+    return dict(x_coord=x_coord, y_coord=y_coord)
 
-def lunarlander_get_nclasses_table(env):
-    return dict(x_coord=env.num_buckets,
-                y_coord=env.num_buckets)
-
-def atari_get_latent_dict(env):
-    env_name = env.env.spec.id
-    ram = env.env.ale.getRAM()
-    len_y, len_x, _ = env.observation_space.shape
+def atari_get_label_dict(raw, num_buckets, env_name):
+    ram = raw["ram"]
     if env_name == 'PrivateEye-v0':
-        x_coord, y_coord = ram[63], ram[86] #y_coord already bucketed to 40
-        x_coord = bucket_coord(coord=x_coord,
-                               num_buckets=env.num_buckets,
-                               max_coord=len_x)
-        latent_dict = dict(x_coord=x_coord,y_coord=y_coord)
+        x_coord = bucket_coord(ram[:,63], num_buckets, ATARI_SCREEN_WIDTH)
+        y_coord = ram[:,86].astype(np.float64) #y_coord already bucketed to 40
+        return dict(x_coord=x_coord, y_coord=y_coord)
     elif env_name == 'Pitfall-v0':
-        x_coord= ram[97] # don't do y_coord its all messed up, y_coord = ram[105]
-        x_coord = bucket_coord(coord=x_coord,
-                               num_buckets=env.num_buckets,
-                               max_coord=len_x)
-        latent_dict = dict(x_coord=x_coord)
+        x_coord = bucket_coord(ram[:,97], num_buckets, ATARI_SCREEN_WIDTH) # y_coord, ram[105], is all messed up
+        return dict(x_coord=x_coord)
+    else:
+        assert False, env_name
+
+def lunarlander_get_label_dict(raw, num_buckets, env_name):
+    x_coord = bucket_coord(raw["x"], num_buckets, 20.5)
+    y_coord = bucket_coord(raw["y"], num_buckets, 13.7)
+    return dict(x_coord=x_coord, y_coord=y_coord)
+
+def flappybird_get_label_dict(raw, num_buckets, env_name):
+    y_coord = bucket_coord(raw["y"], num_buckets, FLAPPYBIRD_HEIGHT)
+    x_pipes = raw["x_pipes"]
+    rows = np.arange(len(x_pipes))
+    # the next pipe is the leftmost one, unless that one is already behind the bird
+    ind_x = np.argmin(x_pipes, axis=1)
+    behind = x_pipes[rows, ind_x] < 0
+    ind_x = np.where(behind, (ind_x + 1) % 3, ind_x)
+    x_pipe = x_pipes[rows, ind_x]
+    x_pipe = np.where(x_pipe > FLAPPYBIRD_MAX_PIPE_DIST, 0, x_pipe)
+    pipe_x_coord = bucket_coord(x_pipe, num_buckets, FLAPPYBIRD_MAX_PIPE_DIST)
+    return dict(y_coord=y_coord, pipe_x_coord=pipe_x_coord)
+
+flappybirdday_get_label_dict = flappybirdnight_get_label_dict = flappybird_get_label_dict
+
+
+def get_label_type(env_name, raw):
+    if "Sonic" in env_name:
+        return "sonic"
+    elif "ram" in raw:
+        return "atari"
     else:
-        assert False
+        return env_name.split("-")[0].lower()
 
-    return latent_dict
+def get_label_dict(env_name, raw, num_buckets):
+    """derives every bucketed label of env_name from a dict of raw state columns"""
+    label_fn = globals()[get_label_type(env_name, raw) + "_get_label_dict"]
+    return label_fn(raw, num_buckets, env_name)
 
-def atari_get_nclasses_table(env):
-    env_name  = env.env.spec.id
-    if env_name == 'PrivateEye-v0':
-        num_x = env.num_buckets
-        num_y = env.num_buckets
-        nclasses_table = dict(x_coord=num_x, y_coord=num_y)
+def get_nclasses_table(env_name, num_buckets):
+    if "Sonic" in env_name or "LunarLander" in env_name or env_name == 'PrivateEye-v0':
+        label_names = ["x_coord", "y_coord"]
     elif env_name == 'Pitfall-v0':
-        num_x = env.num_buckets
-        nclasses_table = dict(x_coord=num_x)
+        label_names = ["x_coord"]
+    elif "FlappyBird" in env_name:
+        label_names = ["y_coord", "pipe_x_coord"]
     else:
-        assert False
-
-    return nclasses_table
-
-
-def monster_kong_get_latent_dict(env):
-    grid_size = env.observation_space.shape[0]
-    player = env.env.game_state.game.newGame.Players[0]
-    (x_coord,y_coord), is_jumping, on_ladder = player.getPosition(), player.isJumping, player.onLadder
-    x_coord, y_coord = bucket_coord(x_coord,env.num_buckets, grid_size),bucket_coord(y_coord,env.num_buckets, grid_size)
-
-    latent_dict = dict(x_coord=x_coord,y_coord=y_coord, is_jumping=is_jumping, on_ladder=on_ladder)
-    return latent_dict
-
-def monster_kong_get_nclasses_table(env):
-    nclasses_table = dict(x_coord=env.num_buckets, y_coord=env.num_buckets,is_jumping=2, on_ladder=2 )
-    return nclasses_table
-
-def waterworld_get_latent_dict(env):
-    len_x, len_y, _ = env.observation_space.shape
-    creeps = env.env.game_state.game.creeps
-    red_enemy = [c for c in creeps if c.TYPE == "BAD"][0]
-    player = env.env.game_state.game.player
-    x_coord, enemy_x = [bucket_coord(coord,env.num_buckets,len_x)\
-                        for coord in [player.pos.x,red_enemy.pos.x ]]
-
-    y_coord, enemy_y = [bucket_coord(coord,env.num_buckets,len_y)\
-                        for coord in [player.pos.y,red_enemy.pos.y ]]
-
-    latent_dict = dict(x_coord = x_coord, y_coord=y_coord,
-                       enemy_x = enemy_x, enemy_y = enemy_y)
-    return latent_dict
-
-def waterworld_get_nclasses_table(env):
-    return dict(x_coord = env.num_buckets, y_coord=env.num_buckets,
-                   enemy_x = env.num_buckets, enemy_y = env.num_buckets)
-    
-
-def snake_get_latent_dict(env):
-    bc = partial(bucket_coord, num_buckets=env.num_buckets, max_coord=64, min_coord=-2)
-    
-    food_x, food_y = env.env.game_state.game.food.pos.x,\
-                     env.env.game_state.game.food.pos.y
-    food_x, food_y = bc(coord=food_x), bc(coord=food_y)
-    
-    head_x, head_y = env.env.game_state.game.player.head.pos.x,\
-                     env.env.game_state.game.player.head.pos.y
-    head_x, head_y = bc(coord=head_x), bc(coord=head_y)
-    
-    latent_dict = dict(x_coord=head_x,y_coord=head_y,food_x=food_x,food_y=food_y)
-    return latent_dict
-
-def snake_get_nclasses_table(env):
-    nclasses = dict(x_coord=env.num_buckets,
-                    y_coord=env.num_buckets,
-                    food_x=env.num_buckets,
-                    food_y=env.num_buckets)
-    return nclasses
-
-
-def flappybird_get_latent_dict(env):
-    y_coord = env.env.game_state.game.player.pos_y
-    y_coord = bucket_coord(y_coord,env.num_buckets,env.env.game_state.game.height)
-    max_pipe_dist = 305
-    x_pipes = [env.env.game_state.game.pipe_group.sprites()[i].x for i in range(3)]
-    min_x = min(x_pipes)
-    ind_x = x_pipes.index(min_x)
-    if min_x < 0:
-        ind_x += 1
-    x_pipe = x_pipes[ind_x]
-    if x_pipe > max_pipe_dist:
-        x_pipe = 0
-
-        
-    pipe_x_coord = bucket_coord(x_pipe, env.num_buckets,max_pipe_dist)
-    latent_dict = dict(y_coord=y_coord, pipe_x_coord=pipe_x_coord)
-    return latent_dict
-
-def flappybird_get_nclasses_table(env):
-    return dict(y_coord=env.num_buckets,pipe_x_coord=env.num_buckets)
-
-flappybirdday_get_latent_dict = flappybirdnight_get_latent_dict = flappybird_get_latent_dict
-flappybirdday_get_nclasses_table = flappybirdnight_get_nclasses_table = flappybird_get_nclasses_table
-
-def catcher_get_latent_dict(env):
-    h,w = env.env.game_state.game.height, env.env.game_state.game.width
-    x_coord = env.env.game_state.game.player.rect.centerx
-    fruit_x, fruit_y = env.env.game_state.game.fruit.rect.centerx,\
-                        env.env.game_state.game.fruit.rect.centery
-    if fruit_y < 0 or fruit_y >= h:
-        fruit_x, fruit_y = 0,0
-    fruit_x = bucket_coord(fruit_x,env.num_buckets,w)
-    fruit_y = bucket_coord(fruit_y,env.num_buckets,h)
-    x_coord = bucket_coord(x_coord,env.num_buckets,w)
-    latent_dict = dict(x_coord=x_coord,fruit_x=fruit_x,fruit_y=fruit_y)
-    return latent_dict
-
-def catcher_get_nclasses_table(env):
-    return dict(x_coord=20,fruit_x=env.num_buckets,fruit_y=env.num_buckets)
\ No newline at end of file
+        assert False, env_name
+    return {label_name: num_buckets for label_name in label_names}
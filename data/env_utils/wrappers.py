@@ -49,10 +49,9 @@ class AtariWrapper(InfoWrapper):
         
            
     def info(self):
-
+        # the whole RAM is recorded, labels are read out of it after collection
         ram = self.env.env.ale.getRAM()
-        x,y = ram[self.xind], ram[self.yind]
-        return dict(x=x,y=y)     
+        return dict(ram=ram.copy())     
 
 class LunarLanderWrapper(InfoWrapper):
     def info(self):
@@ -86,27 +85,13 @@ class SonicWrapper(InfoActionWrapper):
         screen_y = self.env.data.lookup_value("screen_y")
         abs_x = self.env.data.lookup_value("x")
         screen_x = self.env.data.lookup_value("screen_x")
-        x = abs_x - screen_x
-        y = abs_y - screen_y
-        
-        return dict(x=x, y=y)
+        return dict(x=abs_x, y=abs_y, screen_x=screen_x, screen_y=screen_y)
         
         
 class FlappyBirdWrapper(InfoWrapper):
     
     def info(self):
+        # raw positions only, picking the next pipe is done on whole episodes in get_state_params
         y = self.env.env.game_state.game.player.pos_y
-        x_pipes = [self.env.env.game_state.game.pipe_group.sprites()[i].x for i in range(3)]
-        min_x = min(x_pipes)
-        ind_x = x_pipes.index(min_x)
-        if min_x < 0:
-            ind_x = (ind_x + 1) % 3
-        assert ind_x < 3, "whoa whoa %i, %i, %i" %(x_pipes[0],x_pipes[1], x_pipes[2])
-        x_pipe = x_pipes[ind_x]
-        if x_pipe > max_pipe_dist:
-            x_pipe = 0
-
-
-        return dict(y=y,x_pipe=x_pipe)
-    
-
+        x_pipes = np.array([self.env.env.game_state.game.pipe_group.sprites()[i].x for i in range(3)])
+        return dict(y=y,x_pipes=x_pipes)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import numpy as np
+import json
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+from data.utils import appendabledict
+
+
+class EpisodeCache(object):
+    """on-disk store of collected episodes, one directory per episode index
+
+    The cache directory is keyed by a hash of everything that changes what an episode
+    looks like (env, level, resize, max_frames, seed), so every process launched with
+    the same env config shares the same episodes, whatever window size it trains on.
+    Episodes are written to a temporary directory and renamed into place, so
+    concurrent writers never leave a half written episode behind.
+    """
+    def __init__(self, cache_dir, **key_kwargs):
+        self.key_kwargs = key_kwargs
+        self.key = get_cache_key(key_kwargs)
+        self.dir = Path(cache_dir) / self.key
+        self.dir.mkdir(exist_ok=True, parents=True)
+        config_path = self.dir / "config.json"
+        if not config_path.exists():
+            with open(str(config_path), "w") as f:
+                f.write(json.dumps(key_kwargs) + "\n")
+
+    def episode_dir(self, index):
+        return self.dir / ("ep%06i" % index)
+
+    def has(self, index):
+        return self.episode_dir(index).exists()
+
+    def save(self, index, episode):
+        frames, actions, label_dict = episode
+        tmp_dir = self.dir / ("tmp_%s" % uuid.uuid4().hex)
+        tmp_dir.mkdir()
+        np.save(str(tmp_dir / "frames.npy"), frames)
+        np.save(str(tmp_dir / "actions.npy"), actions)
+        for k, v in label_dict.items():
+            np.save(str(tmp_dir / ("label_%s.npy" % k)), v)
+        try:
+            os.rename(str(tmp_dir), str(self.episode_dir(index)))
+        except OSError:
+            # another process got there first, its copy is identical
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+
+    def load(self, index):
+        """loads episode index memory-mapped, so it costs no RAM until it is read"""
+        ep_dir = self.episode_dir(index)
+        frames = np.load(str(ep_dir / "frames.npy"), mmap_mode="r")
+        actions = np.load(str(ep_dir / "actions.npy"), mmap_mode="r")
+        label_dict = appendabledict(list)
+        for label_path in sorted(ep_dir.glob("label_*.npy")):
+            k = label_path.stem[len("label_"):]
+            label_dict[k] = np.load(str(label_path), mmap_mode="r")
+        return frames, actions, label_dict
+
+
+def get_cache_key(key_kwargs):
+    key_str = json.dumps(key_kwargs, sort_keys=True)
+    return hashlib.sha1(key_str.encode()).hexdigest()[:16]
@@ -0,0 +1,93 @@
+import numpy as np
+import os
+import zlib
+from collections import OrderedDict
+
+
+class CompressedFrameStore(object):
+    """read-only frame array kept as zlib compressed chunks of chunk_size frames
+
+    Frames inside a chunk are xor-ed with the frame before them before compressing
+    (delta=True), so the static backgrounds of game frames compress to almost nothing.
+    Decompressed chunks live in an LRU cache of at most cache_mb megabytes.
+    The cache is never pickled, so every DataLoader worker builds its own.
+    Indexing with an int or a slice gives back numpy arrays like the original array.
+    """
+    def __init__(self, frames, chunk_size=32, cache_mb=256, level=1, delta=True):
+        frames = np.asarray(frames)
+        self.shape = frames.shape
+        self.dtype = frames.dtype
+        self.chunk_size = chunk_size
+        self.cache_bytes = int(cache_mb * 2**20)
+        self.delta = delta
+        self.chunks = [self.compress(frames[i:i + chunk_size], level)
+                       for i in range(0, len(frames), chunk_size)]
+        self._reset_cache()
+
+    def compress(self, chunk, level):
+        chunk = np.ascontiguousarray(chunk)
+        if self.delta:
+            delta_chunk = chunk.copy()
+            delta_chunk[1:] = chunk[1:] ^ chunk[:-1]
+            chunk = delta_chunk
+        return zlib.compress(chunk.tobytes(), level)
+
+    def decompress(self, chunk_index):
+        start = chunk_index * self.chunk_size
+        num_frames = min(self.chunk_size, self.shape[0] - start)
+        chunk = np.frombuffer(zlib.decompress(self.chunks[chunk_index]), dtype=self.dtype)
+        chunk = chunk.reshape((num_frames,) + self.shape[1:])
+        if self.delta:
+            chunk = np.bitwise_xor.accumulate(chunk, axis=0)
+        return chunk
+
+    def _reset_cache(self):
+        self._cache = OrderedDict()
+        self._cache_nbytes = 0
+        self._cache_pid = os.getpid()
+
+    def get_chunk(self, chunk_index):
+        if self._cache_pid != os.getpid():
+            self._reset_cache()
+        if chunk_index in self._cache:
+            self._cache.move_to_end(chunk_index)
+            return self._cache[chunk_index]
+        chunk = self.decompress(chunk_index)
+        self._cache[chunk_index] = chunk
+        self._cache_nbytes += chunk.nbytes
+        while self._cache_nbytes > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cache_nbytes -= old.nbytes
+        return chunk
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            inds = np.arange(*index.indices(self.shape[0]))
+            out = np.empty((len(inds),) + self.shape[1:], dtype=self.dtype)
+            chunk_inds = inds // self.chunk_size
+            for chunk_index in np.unique(chunk_inds):
+                mask = chunk_inds == chunk_index
+                out[mask] = self.get_chunk(chunk_index)[inds[mask] - chunk_index * self.chunk_size]
+            return out
+        index = int(index)
+        if index < 0:
+            index += self.shape[0]
+        chunk_index = index // self.chunk_size
+        return self.get_chunk(chunk_index)[index - chunk_index * self.chunk_size]
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """compressed size in bytes, not counting the decompression cache"""
+        return sum([len(chunk) for chunk in self.chunks])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_cache"], state["_cache_nbytes"], state["_cache_pid"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_cache()
@@ -0,0 +1,76 @@
+import threading
+import queue
+import torch
+
+
+class DevicePrefetcher(object):
+    """wraps a batch iterable (DataLoader or stream) and hands out batches already on device
+
+    With num_prefetch > 0 a background thread pulls the next num_prefetch batches,
+    pins them (when device is a gpu) and starts their non-blocking copy to device while
+    the current batch is being trained on. num_prefetch=0 just moves each batch on demand.
+    """
+    def __init__(self, loader, device, num_prefetch=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.use_pinned = self.device.type == "cuda"
+
+    def move(self, batch):
+        if self.use_pinned:
+            batch = batch.pin_memory()
+        return batch.to(self.device, non_blocking=self.use_pinned)
+
+    def __iter__(self):
+        if self.num_prefetch == 0:
+            for batch in self.loader:
+                yield self.move(batch)
+            return
+
+        batches = queue.Queue(maxsize=self.num_prefetch)
+        stop_event = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in self.loader:
+                    if not put(self.move(batch)):
+                        return
+            except Exception as e:
+                put(e)
+            put(done)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # also runs when the consumer stops early, e.g. next(iter(test_set))
+            stop_event.set()
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def dataset(self):
+        return getattr(self.loader, "dataset", None)
+
+    def close(self):
+        # streams own producer processes, DataLoaders have nothing to close
+        if hasattr(self.loader, "close"):
+            self.loader.close()
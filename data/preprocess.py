@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_resize_weights(in_size, out_size):
+    """(out_size, in_size) matrix of bilinear interpolation weights along one axis
+
+    Follows PIL's Image.resize(BILINEAR): when downsampling, the triangle filter is
+    stretched by the scale factor, so every source pixel contributes (antialiasing).
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = filterscale # bilinear filter has support 1
+    weights = np.zeros((out_size, in_size), dtype=np.float32)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        xs = np.arange(xmin, xmax)
+        w = np.clip(1.0 - np.abs((xs - center + 0.5) / filterscale), 0, None)
+        if w.sum() != 0:
+            w = w / w.sum()
+        weights[xx, xmin:xmax] = w
+    return weights
+
+_weights_on_device = {}
+
+def get_resize_weights_tensor(in_size, out_size, device):
+    key = (in_size, out_size, str(device))
+    if key not in _weights_on_device:
+        _weights_on_device[key] = torch.from_numpy(get_resize_weights(in_size, out_size)).to(device)
+    return _weights_on_device[key]
+
+
+def preprocess_frames(frames, resize_to=(-1,-1), to_tensor=True, device="cpu"):
+    """resizes a whole (N,H,W,3) uint8 batch of frames with two matmuls
+
+    to_tensor=True gives a float (N,3,h,w) tensor on device normalized to [-1,1], like
+    Resize, ToTensor and Normalize([0.5,0.5,0.5],[0.5,0.5,0.5]) frame by frame did.
+    to_tensor=False gives a uint8 (N,h,w,3) numpy array, like np.asarray(Resize(image)).
+    """
+    x = torch.from_numpy(np.ascontiguousarray(frames)).to(device)
+    x = x.permute(0, 3, 1, 2).float()
+    in_h, in_w = x.shape[-2:]
+    if resize_to != (-1,-1) and tuple(resize_to) != (in_h, in_w):
+        out_h, out_w = resize_to
+        wy = get_resize_weights_tensor(in_h, out_h, x.device)
+        wx = get_resize_weights_tensor(in_w, out_w, x.device)
+        x = torch.matmul(torch.matmul(wy, x), wx.t())
+    if to_tensor:
+        return x.div_(127.5).sub_(1.)
+    x = x.round_().clamp_(0, 255).permute(0, 2, 3, 1)
+    return x.to("cpu", torch.uint8).numpy()
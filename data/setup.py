@@ -1,23 +1,68 @@
-from data.env_utils import setup_env
 from torch.utils.data.dataset import random_split
-from data.datasets import EpisodeDataset, EnvDataset
+from data.datasets import EpisodeDataset, EnvDataset, EpisodeCorpus
+from data.streaming import StreamingEnvDataset
+from data.utils import collate_transitions, derive_split_seed
+from data.prefetch import DevicePrefetcher
 from torch.utils.data import DataLoader
 import numpy as np
 import torch
 from utils import setup_args
 import sys
 
-def setup_dataset(total_frames, args):
-    env = setup_env(args.env_name)
-    ds = EnvDataset(env=env,
+# one corpus per env/level/seed/resize/buckets, shared by every window view made in this process
+_corpora = {}
+
+def setup_corpus(args, split="train"):
+    seed = derive_split_seed(args.seed, split)
+    key = (args.env_name, args.level, seed, args.episode_max_frames, tuple(args.resize_to), args.buckets)
+    if key not in _corpora:
+        _corpora[key] = EpisodeCorpus(env_name=args.env_name,
+                                      level=args.level,
+                                      seed=seed,
+                                      max_frames=args.episode_max_frames,
+                                      resize_to=args.resize_to,
+                                      num_buckets=args.buckets,
+                                      num_collect_workers=args.collect_workers,
+                                      cache_dir=None if args.no_data_cache else args.data_cache_dir,
+                                      frame_store=get_frame_store_kwargs(args),
+                                      share_dir=args.shared_memory_dir if args.share_memory and args.num_workers > 0 else None)
+    return _corpora[key]
+
+def setup_dataset(total_frames, args, split="train"):
+    corpus = setup_corpus(args, split)
+    ds = EnvDataset(corpus=corpus,
                     total_frames=total_frames,
-                    max_frames=args.episode_max_frames,
-                    resize_to=args.resize_to,
                     frames_per_example=args.frames_per_example,
                     stride=args.stride)
     return ds
 
+def get_frame_store_kwargs(args):
+    if args.frame_store == "compressed":
+        return dict(chunk_size=args.frame_chunk_size, cache_mb=args.frame_cache_mb)
+    return None
+
+def setup_stream_dataset(args):
+    stream = StreamingEnvDataset(env_name=args.env_name,
+                                 level=args.level,
+                                 seed=derive_split_seed(args.seed, "stream"),
+                                 num_workers=max(args.collect_workers, 1),
+                                 batch_size=args.batch_size,
+                                 batches_per_epoch=args.tr_size // args.batch_size,
+                                 capacity=args.stream_capacity,
+                                 min_frames=args.stream_min_frames,
+                                 buffer_mode=args.stream_buffer,
+                                 num_buckets=args.buckets,
+                                 max_frames=args.episode_max_frames,
+                                 resize_to=args.resize_to,
+                                 frames_per_example=args.frames_per_example,
+                                 stride=args.stride)
+    return stream
+
 def setup_train_data(args):
+    if args.stream:
+        val = setup_dataset(args.val_size, args)
+        tr = setup_stream_dataset(args)
+        return tr,val
     total_frames = args.tr_size + args.val_size
     ds = setup_dataset(total_frames, args)
     lens = [args.tr_size, args.val_size]
@@ -28,7 +73,7 @@ def setup_train_data(args):
 
 def setup_test_data(args):
     total_frames = args.test_size
-    test_ds = setup_dataset(total_frames, args)
+    test_ds = setup_dataset(total_frames, args, split="test")
     return test_ds,
     
     
@@ -41,6 +86,10 @@ def setup_data(args):
     setup_dataset_fn = getattr(this_module, "setup_" + args.mode + "_data")
     datasets = setup_dataset_fn(args)
     
-    dataloader_kwargs = dict(batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
-    dataloaders = [DataLoader(dataset,**dataloader_kwargs) for dataset in datasets]
+    dataloader_kwargs = dict(batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                             collate_fn=collate_transitions)
+    # streams already yield collated batches
+    dataloaders = [dataset if isinstance(dataset, StreamingEnvDataset) else DataLoader(dataset,**dataloader_kwargs)
+                   for dataset in datasets]
+    dataloaders = [DevicePrefetcher(loader, args.device, num_prefetch=args.prefetch) for loader in dataloaders]
     return dataloaders
\ No newline at end of file
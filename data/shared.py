@@ -0,0 +1,72 @@
+import numpy as np
+import os
+import atexit
+import shutil
+import warnings
+import tempfile
+import uuid
+from pathlib import Path
+
+
+class SharedArrayRef(object):
+    """picklable handle to a memory-mapped array, reattached by file name on unpickling"""
+    __slots__ = ["filename", "dtype", "shape", "offset"]
+
+    def __init__(self, arr):
+        self.filename = arr.filename
+        self.dtype = arr.dtype
+        self.shape = arr.shape
+        self.offset = arr.offset
+
+    def attach(self):
+        return np.memmap(self.filename, dtype=self.dtype, mode="r", shape=self.shape, offset=self.offset)
+
+
+def to_shared_ref(arr):
+    """memmaps become SharedArrayRefs so pickling them (e.g. into DataLoader workers)
+    sends a file name instead of the data. Anything else is left as is"""
+    if isinstance(arr, np.memmap) and arr.filename is not None:
+        return SharedArrayRef(arr)
+    return arr
+
+def from_shared_ref(obj):
+    return obj.attach() if isinstance(obj, SharedArrayRef) else obj
+
+
+_share_dirs = {}
+
+def get_share_dir(base_dir="/dev/shm"):
+    """per process directory for shared arrays, removed when the creating process exits"""
+    pid = os.getpid()
+    if pid not in _share_dirs:
+        base_dir = base_dir if Path(base_dir).exists() else tempfile.gettempdir()
+        share_dir = Path(tempfile.mkdtemp(prefix="episodes_", dir=base_dir))
+        _share_dirs[pid] = share_dir
+        atexit.register(_remove_share_dir, pid, share_dir)
+    return _share_dirs[pid]
+
+def _remove_share_dir(pid, share_dir):
+    # forked children inherit the atexit hook, only the owner cleans up
+    if os.getpid() == pid:
+        shutil.rmtree(str(share_dir), ignore_errors=True)
+
+
+def share_array(arr, base_dir="/dev/shm", min_free_mb=64):
+    """copies arr into a file under the share dir and returns a read-only memmap of it.
+    When that would leave less than min_free_mb free (e.g. docker's 64MB /dev/shm), arr
+    stays an in-process array, writing anyway would fail partway with SIGBUS or ENOSPC"""
+    if isinstance(arr, np.memmap):
+        return arr
+    arr = np.asarray(arr)
+    if arr.size == 0:
+        return arr
+    share_dir = get_share_dir(base_dir)
+    if shutil.disk_usage(str(share_dir)).free - arr.nbytes < min_free_mb * 2**20:
+        warnings.warn("not enough space in %s to share a %.1fMB array, keeping it in process" % (share_dir, arr.nbytes / 2**20))
+        return arr
+    path = str(share_dir / (uuid.uuid4().hex + ".dat"))
+    out = np.memmap(path, dtype=arr.dtype, mode="w+", shape=arr.shape)
+    out[:] = arr
+    out.flush()
+    del out
+    return np.memmap(path, dtype=arr.dtype, mode="r", shape=arr.shape)
@@ -0,0 +1,151 @@
+import numpy as np
+import queue
+import multiprocessing as mp
+from collections import deque
+from data.datasets import EpisodeDataset
+from data.utils import collate_transitions, derive_seed, appendabledict
+from data.env_utils.get_state_params import get_label_dict
+from data.env_utils.env_setup import setup_env
+
+
+class ReplayBuffer(object):
+    """bounded store of collected episodes that windows are sampled from
+
+    mode="fifo" evicts the oldest episodes once capacity (in frames) is exceeded.
+    mode="reservoir" keeps a uniform sample over every episode seen so far.
+    """
+    def __init__(self, capacity, mode="fifo", seed=0):
+        assert mode in ["fifo", "reservoir"], mode
+        self.capacity = capacity
+        self.mode = mode
+        self.rng = np.random.RandomState(seed)
+        self.episodes = deque()
+        self.num_frames = 0
+        self.num_seen = 0
+
+    def add(self, ep):
+        self.num_seen += 1
+        if self.mode == "reservoir" and self.num_frames + len(ep.frames) > self.capacity:
+            if self.rng.rand() >= len(self.episodes) / self.num_seen:
+                return
+            self.remove(self.rng.randint(len(self.episodes)))
+        self.episodes.append(ep)
+        self.num_frames += len(ep.frames)
+        while self.num_frames > self.capacity and len(self.episodes) > 1:
+            self.remove(0)
+
+    def remove(self, index):
+        ep = self.episodes[index]
+        del self.episodes[index]
+        self.num_frames -= len(ep.frames)
+
+    @property
+    def num_examples(self):
+        return sum([len(ep) for ep in self.episodes])
+
+    def sample(self, batch_size):
+        lens = np.asarray([len(ep) for ep in self.episodes], dtype=np.float64)
+        ep_inds = self.rng.choice(len(lens), size=batch_size, p=lens / lens.sum())
+        return [self.episodes[i][self.rng.randint(len(self.episodes[i]))] for i in ep_inds]
+
+
+class StreamingEnvDataset(object):
+    """stream of training batches sampled from episodes that are collected while training
+
+    num_workers background processes keep calling EpisodeDataset.collect_episode and push
+    the episodes through a bounded queue into a ReplayBuffer. Iterating yields
+    batches_per_epoch collated batches, so it can be used wherever a DataLoader is.
+    Training starts as soon as min_frames examples are in the buffer and memory stays
+    bounded by capacity however many frames are generated in total.
+    """
+    def __init__(self,
+                 env_name,
+                 batch_size,
+                 batches_per_epoch,
+                 capacity,
+                 level="None",
+                 seed=0,
+                 num_workers=1,
+                 min_frames=1000,
+                 buffer_mode="fifo",
+                 num_buckets=16,
+                 **kwargs):
+        self.batch_size = batch_size
+        self.batches_per_epoch = batches_per_epoch
+        self.min_frames = max(min(min_frames, capacity), 1)
+        self.kwargs = kwargs
+        self.env_name = env_name
+        self.num_buckets = num_buckets
+        self.buffer = ReplayBuffer(capacity, mode=buffer_mode, seed=seed)
+        self.queue = mp.Queue(maxsize=2 * num_workers)
+        self.stop_event = mp.Event()
+        self.workers = [mp.Process(target=_produce_episodes,
+                                   args=(env_name, level, seed, worker_id, num_workers,
+                                         kwargs, self.queue, self.stop_event),
+                                   daemon=True)
+                        for worker_id in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def drain(self, block=False):
+        while True:
+            try:
+                episode = self.queue.get(block=block, timeout=60 if block else None)
+            except queue.Empty:
+                if block:
+                    self.check_workers()
+                return
+            frames, actions, raw = episode
+            label_dict = appendabledict(list, get_label_dict(self.env_name, raw, self.num_buckets))
+            self.buffer.add(EpisodeDataset(env=None, episode=(frames, actions, label_dict), **self.kwargs))
+            block = False
+
+    def __iter__(self):
+        for _ in range(self.batches_per_epoch):
+            self.drain()
+            while self.buffer.num_examples < self.min_frames:
+                self.drain(block=True)
+            yield collate_transitions(self.buffer.sample(self.batch_size))
+
+    def __len__(self):
+        return self.batches_per_epoch
+
+    def check_workers(self):
+        # producers only stop when closed, one that exited died (e.g. on an env error)
+        exitcodes = [worker.exitcode for worker in self.workers]
+        if any(code is not None for code in exitcodes):
+            raise RuntimeError("stream producers exited with codes %s" % exitcodes)
+
+    def close(self):
+        self.stop_event.set()
+        # unblock producers stuck on a full queue
+        self.drain()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+                # reap it, so it doesn't stay around as a zombie
+                worker.join(timeout=5)
+        # episodes still in the pipe are dropped instead of waited on at exit
+        self.queue.cancel_join_thread()
+        self.queue.close()
+
+
+def _produce_episodes(env_name, level, seed, worker_id, num_workers, kwargs, episode_queue, stop_event):
+    # a producer stopped with episodes still buffered in the feeder thread must not hang on exit
+    episode_queue.cancel_join_thread()
+    env = setup_env(env_name, level=level)
+    episode_index = worker_id
+    try:
+        while not stop_event.is_set():
+            ep = EpisodeDataset(env=env, seed=derive_seed(seed, episode_index), **kwargs)
+            episode = ep.frames, ep.actions, ep.label_dict
+            while not stop_event.is_set():
+                try:
+                    episode_queue.put(episode, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+            episode_index += num_workers
+    finally:
+        env.close()
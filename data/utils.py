@@ -9,7 +9,18 @@ import numpy as np
 from collections import namedtuple
 import copy
 from collections import defaultdict
+import zlib
+from data.preprocess import preprocess_frames
+
 def convert_frame(obs, resize_to=(-1,-1),to_tensor=False,device="cpu"):
+    return preprocess_frames(obs[None], resize_to=resize_to, to_tensor=to_tensor, device=device)[0]
+
+def convert_frames(frames,resize_to=(-1,-1),to_tensor=False,device="cpu"):
+    frames = preprocess_frames(np.stack(frames), resize_to=resize_to, to_tensor=to_tensor, device=device)
+    return frames if to_tensor else torch.from_numpy(frames)
+
+def pil_convert_frame(obs, resize_to=(-1,-1),to_tensor=False,device="cpu"):
+    """the original one frame at a time PIL path, kept as the reference for preprocess_frames"""
     pil_image = Image.fromarray(obs, 'RGB')
     
     transforms = [Resize(resize_to)] if resize_to != (-1,-1) else []
@@ -26,9 +37,59 @@ def convert_frame(obs, resize_to=(-1,-1),to_tensor=False,device="cpu"):
     
     return frame
 
-def convert_frames(frames,resize_to=(-1,-1),to_tensor=False,device="cpu"):
-    convert = partial(convert_frame,resize_to=resize_to,to_tensor=to_tensor,device=device)
-    return torch.stack([convert(frame) for frame in frames])
+
+def normalize_frames(frames):
+    """turns a uint8 (...,H,W,3) tensor into a float (...,3,H,W) tensor in [-1,1]
+    matching ToTensor followed by Normalize([0.5,0.5,0.5],[0.5,0.5,0.5])"""
+    nd = frames.dim()
+    frames = frames.permute(*range(nd - 3), nd - 1, nd - 3, nd - 2)
+    return frames.float().div_(127.5).sub_(1.)
+
+class Transition(object):
+    """a batch of windows: xs (B,T,3,H,W) frames, actions (B,T-1) taken between
+    consecutive frames and state_param_dict mapping each label name to a (B,T) tensor.
+    embeddings is only set for batches of precomputed embeddings (then xs may be None)"""
+    __slots__ = ["xs", "actions", "state_param_dict", "embeddings"]
+
+    def __init__(self, xs, actions, state_param_dict, embeddings=None):
+        self.xs = xs
+        self.actions = actions
+        self.state_param_dict = state_param_dict
+        self.embeddings = embeddings
+
+    def apply(self, fn):
+        fn_or_none = lambda t: None if t is None else fn(t)
+        return Transition(fn_or_none(self.xs), fn_or_none(self.actions),
+                          {k: fn(v) for k, v in self.state_param_dict.items()},
+                          fn_or_none(self.embeddings))
+
+    def to(self, device, non_blocking=False):
+        return self.apply(lambda t: t.to(device, non_blocking=non_blocking))
+
+    def pin_memory(self):
+        return self.apply(lambda t: t.pin_memory())
+
+
+def collate_transitions(batch):
+    """collates (frames, actions, labels) examples into a Transition
+
+    Frames come in as uint8 (T,H,W,3) windows. Every field is copied once into a
+    preallocated array for the whole batch and the frames are normalized in one go.
+    """
+    frames, actions, labels = batch[0]
+    batch_size = len(batch)
+    xs = np.empty((batch_size,) + frames.shape, dtype=np.uint8)
+    acts = np.empty((batch_size,) + actions.shape, dtype=actions.dtype)
+    label_arrs = {k: np.empty((batch_size,) + v.shape, dtype=v.dtype) for k, v in labels.items()}
+    for i, (frames, actions, labels) in enumerate(batch):
+        xs[i] = frames
+        acts[i] = actions
+        for k, v in labels.items():
+            label_arrs[k][i] = v
+    state_param_dict = {k: torch.from_numpy(v) for k, v in label_arrs.items()}
+    return Transition(xs=normalize_frames(torch.from_numpy(xs)),
+                      actions=torch.from_numpy(acts),
+                      state_param_dict=state_param_dict)
 
 
 class appendabledict(defaultdict):
@@ -73,4 +134,84 @@ class appendabledict(defaultdict):
 
          """
         for k,v in other_dict.items():
-            self.__getitem__(k).append(v)
\ No newline at end of file
+            self.__getitem__(k).append(v)
+
+
+class EpisodeBuffer(object):
+    """struct-of-arrays store for one episode: frames, actions and one column per label
+
+    Every column is a numpy array allocated on first append (dtype and shape taken from
+    that first value) with room for capacity rows, and doubled when it fills up, but never
+    past max_rows. So collecting never holds a python object per step, and an episode
+    that reaches max_rows needs no trimming. Columns are resized in place, so get_episode
+    frees the unused rows of a shorter episode without a second copy where realloc allows.
+    """
+    def __init__(self, capacity=1024, max_rows=np.inf):
+        self.max_rows = max_rows
+        self.capacity = int(min(capacity, max_rows))
+        self.num_frames = 0
+        self.num_actions = 0
+        self.frame_col = None
+        self.action_col = None
+        self.label_cols = {}
+
+    def _alloc(self, value):
+        value = np.asarray(value)
+        return np.empty((self.capacity,) + value.shape, dtype=value.dtype)
+
+    def _resize(self, col, num_rows):
+        # the buffer owns its columns and hands out no views while collecting
+        col.resize((int(num_rows),) + col.shape[1:], refcheck=False)
+        return col
+
+    def _grow(self, col):
+        return self._resize(col, min(2 * len(col), self.max_rows))
+
+    def append_frame(self, frame, info):
+        """appends a frame and the label dict (info) that goes with it"""
+        if self.frame_col is None:
+            self.frame_col = self._alloc(frame)
+            self.label_cols = {k: self._alloc(v) for k, v in info.items()}
+        if self.num_frames == len(self.frame_col):
+            self.frame_col = self._grow(self.frame_col)
+            self.label_cols = {k: self._grow(v) for k, v in self.label_cols.items()}
+        self.frame_col[self.num_frames] = frame
+        for k, v in info.items():
+            self.label_cols[k][self.num_frames] = v
+        self.num_frames += 1
+
+    def append_action(self, action):
+        if self.action_col is None:
+            self.action_col = self._alloc(action)
+        if self.num_actions == len(self.action_col):
+            self.action_col = self._grow(self.action_col)
+        self.action_col[self.num_actions] = action
+        self.num_actions += 1
+
+    def _trim(self, col, num_rows):
+        return self._resize(col, num_rows) if num_rows < len(col) else col
+
+    def get_episode(self):
+        """the collected (frames, actions, label_dict), columns trimmed to the episode length.
+        The buffer is done after this, the returned arrays are its columns"""
+        frames = self._trim(self.frame_col, self.num_frames)
+        if self.action_col is None:
+            actions = np.empty((0,), dtype=np.int64)
+        else:
+            actions = self._trim(self.action_col, self.num_actions)
+        label_dict = appendabledict(list)
+        for k, v in self.label_cols.items():
+            label_dict[k] = self._trim(v, self.num_frames)
+        return frames, actions, label_dict
+
+
+def derive_seed(seed, index):
+    """deterministically derives a per-episode seed from the run seed and the episode index,
+    so an episode comes out the same no matter which process collects it"""
+    return (seed * 1000003 + index) % (2**31 - 1)
+
+
+def derive_split_seed(seed, split):
+    """train keeps the run seed, every other split (test, stream, ...) gets its own so
+    its episodes never repeat the training episodes"""
+    return seed if split == "train" else derive_seed(seed, zlib.crc32(split.encode()))
@@ -0,0 +1,30 @@
+import torch
+from torch import nn
+import numpy as np
+
+
+class ControlEvalModel(nn.Module):
+    """linear policy on top of a frozen encoder, whose weights are set from a flat parameter vector (a CMA-ES candidate)"""
+    def __init__(self, encoder, num_actions, parameters=None):
+        super(ControlEvalModel,self).__init__()
+        self.encoder = encoder
+        self.fc = nn.Linear(in_features=encoder.embed_len, out_features=num_actions)
+        if parameters is not None:
+            self.set_parameters(parameters)
+
+    @property
+    def num_parameters(self):
+        return self.fc.weight.numel() + self.fc.bias.numel()
+
+    def set_parameters(self, parameters):
+        parameters = torch.from_numpy(np.asarray(parameters, dtype=np.float32))
+        num_weights = self.fc.weight.numel()
+        self.fc.weight.data.copy_(parameters[:num_weights].view_as(self.fc.weight))
+        self.fc.bias.data.copy_(parameters[num_weights:])
+
+    def forward(self, x):
+        """greedy actions (B,) for a batch of frames (B,3,H,W)"""
+        with torch.no_grad():
+            embeddings = self.encoder(x)
+            logits = self.fc(embeddings)
+        return torch.argmax(logits, dim=1)
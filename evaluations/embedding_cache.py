@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+from pathlib import Path
+from data.utils import Transition
+
+
+def alloc_array(shape, dtype, out_dir=None, name="array"):
+    """plain array, or a memory-mapped .npy file under out_dir when it's given"""
+    if out_dir is None:
+        return np.empty(shape, dtype=dtype)
+    path = Path(out_dir)
+    path.mkdir(exist_ok=True, parents=True)
+    return np.lib.format.open_memmap(str(path / (name + ".npy")), mode="w+", dtype=dtype, shape=shape)
+
+
+def extract_embeddings(loader, embed_fn, label_fn, out_dir=None):
+    """runs embed_fn over every batch of loader under no_grad, writing as it goes
+
+    embed_fn(trans) gives a (rows, E) tensor and label_fn(trans) a dict of (rows,) label
+    tensors for each batch. The outputs are preallocated for the whole dataset from the
+    first batch's shapes (memory-mapped under out_dir when it's given), so the only
+    activations alive at any time are one batch's and no autograd graph is kept.
+    Returns the (N, E) embeddings and a dict of (N,) labels.
+    """
+    num_examples = len(loader.dataset)
+    embeddings, labels = None, {}
+    n = 0
+    with torch.no_grad():
+        for trans in loader:
+            f = embed_fn(trans)
+            b = f.shape[0]
+            if embeddings is None:
+                num_rows = num_examples * (b // trans.xs.shape[0])
+                embeddings = alloc_array((num_rows, f.shape[1]), np.float32, out_dir, "embeddings")
+            embeddings[n:n + b] = f.cpu().numpy()
+            for k, v in label_fn(trans).items():
+                y = v.cpu().numpy()
+                if k not in labels:
+                    labels[k] = alloc_array((embeddings.shape[0],), y.dtype, out_dir, "label_" + k)
+                labels[k][n:n + b] = y
+            n += b
+    return embeddings[:n], {k: v[:n] for k, v in labels.items()}
+
+
+class EmbeddingCache(object):
+    """(N, embed_len) embeddings of every example of loader under a frozen encoder, with the labels
+
+    The encoder runs once over the whole dataset under no_grad. Iterating then yields
+    Transitions carrying only embeddings and state_param_dict, so a linear probe can be
+    trained for as many epochs as it likes without touching the encoder again.
+    Each example is embedded from its first frame, as InferModel does.
+    """
+    def __init__(self, loader, encoder, batch_size, device="cpu", out_dir=None, shuffle=True):
+        self.batch_size = batch_size
+        self.device = device
+        self.shuffle = shuffle
+        self.embeddings, self.labels = extract_embeddings(loader,
+                                                          embed_fn=lambda trans: encoder(trans.xs[:,0]),
+                                                          label_fn=lambda trans: {k: v[:,0] for k, v in trans.state_param_dict.items()},
+                                                          out_dir=out_dir)
+        self.num_examples = self.embeddings.shape[0]
+
+    def __iter__(self):
+        inds = np.random.permutation(self.num_examples) if self.shuffle else np.arange(self.num_examples)
+        for start in range(0, self.num_examples, self.batch_size):
+            batch_inds = np.sort(inds[start:start + self.batch_size])
+            embeddings = torch.from_numpy(self.embeddings[batch_inds]).to(self.device)
+            state_param_dict = {k: torch.from_numpy(v[batch_inds])[:,None].to(self.device)
+                                for k, v in self.labels.items()}
+            # labels get a time axis of 1 so they index like a one frame window
+            yield Transition(xs=None, actions=None, state_param_dict=state_param_dict, embeddings=embeddings)
+
+    def __len__(self):
+        return int(np.ceil(self.num_examples / self.batch_size))
@@ -6,20 +6,31 @@ from evaluations.utils import classification_acc
 from evaluations.linear_model import LinearModel
 
 
-class InferModel(nn.Module):
-    """feeds embeddings from encoder into linear model for inference or prediction depending on what the inputs to the linear model are"""
-    def __init__(self, encoder, num_classes, args):
-        super(InferModel,self).__init__()
+class BaseInferModel(nn.Module):
+    """frozen encoder whose detached embeddings of a window's first frame feed linear probes"""
+    def __init__(self, encoder, args):
+        super(BaseInferModel,self).__init__()
         self.encoder = encoder
         #self.model_type = args.model_type # classifier or regressor
-        self.label_name = args.label_name #y_coord or x_coord or other state variables
+        self.label_name = args.label_name #y_coord or x_coord or other state variables, "all" for MultiInferModel
+
+    def embed(self,trans):
+        if trans.embeddings is not None: # precomputed by an EmbeddingCache
+            return trans.embeddings
+        x = trans.xs[:,0]
+        embeddings = self.encoder(x)
+        return embeddings.detach()
+
+
+class InferModel(BaseInferModel):
+    """feeds embeddings from encoder into linear model for inference or prediction depending on what the inputs to the linear model are"""
+    def __init__(self, encoder, num_classes, args):
+        super(InferModel,self).__init__(encoder, args)
         self.linear_model = LinearModel(output_len=num_classes,
                                  input_len=encoder.embed_len)
      
     def forward(self,trans):
-        x = trans.xs[:,0]
-        embeddings = self.encoder(x)
-        embeddings = embeddings.detach()
+        embeddings = self.embed(trans)
         pred = self.linear_model(embeddings)
         return pred
         
@@ -38,6 +49,24 @@ class InferModel(nn.Module):
         return loss, acc
 
 
-    
-    
-    
\ No newline at end of file
+class MultiInferModel(BaseInferModel):
+    """one linear model per label in nclasses_table, all fed by the same encoder forward"""
+    def __init__(self, encoder, nclasses_table, args):
+        super(MultiInferModel,self).__init__(encoder, args)
+        self.label_names = sorted(nclasses_table)
+        self.linear_models = nn.ModuleDict({label_name: LinearModel(output_len=nclasses_table[label_name],
+                                                                    input_len=encoder.embed_len)
+                                            for label_name in self.label_names})
+
+    def forward(self,trans):
+        embeddings = self.embed(trans)
+        return {label_name: self.linear_models[label_name](embeddings) for label_name in self.label_names}
+
+    def loss_acc(self,trans):
+        preds = self.forward(trans)
+        losses, accs = {}, {}
+        for label_name, pred in preds.items():
+            y = trans.state_param_dict[label_name][:,0].long()
+            losses[label_name] = nn.CrossEntropyLoss()(pred,y)
+            accs[label_name] = classification_acc(pred,y)
+        return losses, accs
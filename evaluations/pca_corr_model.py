@@ -1,20 +1,91 @@
 import torch
-import copy
-#from sklearn.metrics import explained_variance_score, r2_score
-from sklearn.decomposition import PCA
-from scipy.stats import spearmanr
-
-def compute_pca_corr(embeddings,labels, num_components=5):
-        pca = PCA(n_components=num_components)
-        print(embeddings.shape)
-        pcs = pca.fit_transform(embeddings.data)
-        evr = pca.explained_variance_ratio_
-        sp_corr = [spearmanr(labels,pcs[:,i])[0] for i in range(num_components)]
-        inds = [str(i+1) for i in range(num_components)]
-        evr_dict = dict(zip(inds,evr))
-        sp_corr_dict = dict(zip(inds,sp_corr))
-        
-        return sp_corr_dict , evr_dict
-        
-
-        
\ No newline at end of file
+import numpy as np
+
+
+def to_numpy(x):
+    return x.cpu().numpy() if torch.is_tensor(x) else np.asarray(x)
+
+
+def fit_pca(embeddings, num_components=5, chunk_size=65536):
+    """principal components of the rows of embeddings, streaming over chunks of rows
+
+    Only the (E,) sum and (E,E) second moment are accumulated, in float64, so memory
+    doesn't grow with the number of rows and embeddings can be a memmap or tensor of any length.
+    Components get sklearn's sign convention of a positive largest loading.
+    Returns mean (E,), components (num_components, E) and explained variance ratios.
+    """
+    n = embeddings.shape[0]
+    s = 0.
+    xtx = 0.
+    for start in range(0, n, chunk_size):
+        x = to_numpy(embeddings[start:start + chunk_size]).astype(np.float64)
+        s = s + x.sum(axis=0)
+        xtx = xtx + x.T.dot(x)
+    mean = s / n
+    cov = (xtx - n * np.outer(mean, mean)) / (n - 1)
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    order = np.argsort(eigvals)[::-1][:num_components]
+    components = eigvecs[:, order].T
+    signs = np.sign(components[np.arange(len(order)), np.abs(components).argmax(axis=1)])
+    components *= signs[:,None]
+    evr = np.maximum(eigvals[order], 0) / np.maximum(eigvals, 0).sum()
+    return mean, components, evr
+
+
+def project(embeddings, mean, components, chunk_size=65536):
+    n = embeddings.shape[0]
+    pcs = np.empty((n, components.shape[0]), dtype=np.float64)
+    for start in range(0, n, chunk_size):
+        x = to_numpy(embeddings[start:start + chunk_size]).astype(np.float64)
+        pcs[start:start + chunk_size] = (x - mean).dot(components.T)
+    return pcs
+
+
+def rank_columns(a):
+    """average ranks (ties share the mean of their ranks, as in scipy.stats.rankdata) of every column of a at once"""
+    n, m = a.shape
+    cols = np.arange(m)
+    order = np.argsort(a, axis=0, kind="mergesort")
+    sorted_a = a[order, cols]
+    new_group = np.ones((n, m), dtype=bool)
+    new_group[1:] = sorted_a[1:] != sorted_a[:-1]
+    pos = np.arange(n)[:,None]
+    # first and last sorted position of the tie group of each element
+    first = np.maximum.accumulate(np.where(new_group, pos, 0), axis=0)
+    group_end = np.ones((n, m), dtype=bool)
+    group_end[:-1] = new_group[1:]
+    last = np.minimum.accumulate(np.where(group_end, pos, n - 1)[::-1], axis=0)[::-1]
+    ranks = np.empty((n, m), dtype=np.float64)
+    ranks[order, cols] = (first + last) / 2. + 1
+    return ranks
+
+
+def spearman_matrix(a, b):
+    """(a_cols, b_cols) spearman correlations between every column of a and every column of b"""
+    ranks = rank_columns(np.hstack([a, b]))
+    ranks -= ranks.mean(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ranks /= np.sqrt((ranks ** 2).sum(axis=0))
+    return ranks[:, :a.shape[1]].T.dot(ranks[:, a.shape[1]:])
+
+
+def compute_pca_corr(embeddings,labels, num_components=5, chunk_size=65536):
+    """spearman correlation of the top principal components of embeddings with labels
+
+    labels is an (N,) array, or a dict of them, in which case the components are fit once
+    and a dict of correlation dicts, one per label, is returned.
+    """
+    print(embeddings.shape)
+    mean, components, evr = fit_pca(embeddings, num_components, chunk_size)
+    pcs = project(embeddings, mean, components, chunk_size)
+    label_dict = labels if isinstance(labels, dict) else {"label": labels}
+    label_names = list(label_dict)
+    ys = np.stack([to_numpy(label_dict[k]).reshape(-1).astype(np.float64) for k in label_names], axis=1)
+    corr = spearman_matrix(pcs, ys)
+
+    inds = [str(i+1) for i in range(len(evr))]
+    evr_dict = dict(zip(inds,evr))
+    sp_corr_dicts = {k: dict(zip(inds, corr[:, j])) for j, k in enumerate(label_names)}
+    if not isinstance(labels, dict):
+        return sp_corr_dicts["label"], evr_dict
+    return sp_corr_dicts, evr_dict
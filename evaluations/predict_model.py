@@ -15,28 +15,33 @@ class PredictModel(nn.Module):
         self.embed_len = self.encoder.embed_len
         self.num_actions = self.args.num_actions
         self.predictor = OneStepForwardModel(self.encoder, self.num_actions)
+        self._embedded_trans = None
+        self._embeddings = None
     
     def embed_state(self,trans,index):
-        t = index
-        xt = trans.xs[:,t]
-        ft = self.encoder(xt).detach()
-        return ft
+        return self.get_all_embeddings(trans)[:,index]
     
     def get_all_embeddings(self,trans):
-        fs = [self.embed_state(trans,i) for i in range(trans.xs.shape[1])]
-        return fs
+        """(B,T,embed_len) embeddings of every frame of the batch from one no-grad encoder pass,
+        memoized so the frozen encoder sees each batch only once however often it's asked"""
+        if self._embedded_trans is not trans:
+            with torch.no_grad():
+                self._embeddings = self.encoder.encode_sequence(trans.xs).detach()
+            self._embedded_trans = trans
+        return self._embeddings
             
     def forward(self, trans):
 
         f_trues = self.get_all_embeddings(trans)
-        f_preds = []
+        num_steps = trans.actions.shape[1]
 
         # predict n steps forward where n = frames_per_example - 1
-        for t in range(trans.actions.shape[1]):
-            if self.args.mode == "train": # teacher forcing
-                ft = f_trues[t]
-            elif self.args.mode == "test": #non teacher forcing
-                ft = f_trues[t] if t == 0 else ftp1_pred
+        if self.args.mode == "train": # teacher forcing, so every step at once
+            return self.predictor(f_trues[:,:num_steps],trans.actions)
+        
+        f_preds = []
+        for t in range(num_steps): #non teacher forcing
+            ft = f_trues[:,t] if t == 0 else ftp1_pred
             at = trans.actions[:,t]
             ftp1_pred = self.predictor(ft,at)
             f_preds.append(ftp1_pred)
@@ -47,18 +52,11 @@ class PredictModel(nn.Module):
         
     
     def loss_acc(self,trans):
-        f_trues = torch.stack(self.get_all_embeddings(trans), dim=1)
+        f_trues = self.get_all_embeddings(trans)
         f_preds = self.forward(trans)
 
-        
-        losses = []
-        for i in range(f_preds.shape[1]):
-            f_pred = f_preds[:,i]
-            f_true = f_trues[:,i+1] # we don't predict f0
-            loss = self.predictor.loss(f_true, f_pred)
-            losses.append(loss)
-
-        loss = torch.mean(torch.stack(losses,dim=0))
+        # we don't predict f0
+        loss = self.predictor.loss(f_trues[:,1:f_preds.shape[1] + 1], f_preds)
         acc = None
         return loss,acc
     
@@ -79,13 +77,13 @@ class OneStepForwardModel(nn.Module):
         
         
     def forward(self,ft, a):
-
-        a = convert_to1hot(a,self.num_actions).float()
+        """ft is (B,embed_len) with actions a (B,) or, for many steps at once, (B,T,embed_len) with a (B,T)"""
+        a = convert_to1hot(a.contiguous().view(-1),self.num_actions).float().view(*a.shape, self.num_actions)
         #double check make sure embedding is detached
         if ft.requires_grad:
             #print("eeek")
             ft = ft.detach()
-        inp = torch.cat((ft,a),dim=1)
+        inp = torch.cat((ft,a),dim=-1)
         ftp1_pred = self.fc(inp)
         return ftp1_pred
            
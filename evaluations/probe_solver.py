@@ -0,0 +1,104 @@
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    p = np.exp(logits)
+    return p / p.sum(axis=1, keepdims=True)
+
+
+def logistic_loss_grad(Wb, X1, Y, l2):
+    """mean cross entropy (+ l2/2 ||W||^2, bias not penalized) and its gradient wrt Wb (C, E+1)"""
+    P = softmax(X1.dot(Wb.T))
+    n = X1.shape[0]
+    loss = -np.log(np.maximum(P[Y.astype(bool)], 1e-12)).mean()
+    loss += 0.5 * l2 * (Wb[:,:-1] ** 2).sum()
+    grad = (P - Y).T.dot(X1) / n
+    grad[:,:-1] += l2 * Wb[:,:-1]
+    return loss, grad, P
+
+
+def fit_newton(X, y, weight, bias, l2=1e-4, tol=1e-6, max_iter=100):
+    """multinomial logistic regression by damped Newton (IRLS) with a backtracking line search
+
+    The full (C(E+1), C(E+1)) hessian is built every iteration, which is cheap for
+    probes on small embeddings and converges in a handful of steps.
+    """
+    X1 = np.hstack([X, np.ones((X.shape[0], 1))]).astype(np.float64)
+    n, d = X1.shape
+    num_classes = weight.shape[0]
+    Y = np.zeros((n, num_classes))
+    Y[np.arange(n), y] = 1.
+    Wb = np.hstack([weight, bias[:,None]]).astype(np.float64)
+    # l2 on the weights, plus a tiny ridge on everything since softmax is invariant to shifting all classes
+    ridge = np.full((num_classes, d), l2)
+    ridge[:,-1] = 0.
+    ridge = ridge.ravel() + 1e-8
+
+    loss, grad, P = logistic_loss_grad(Wb, X1, Y, l2)
+    for _ in range(max_iter):
+        if np.abs(grad).max() < tol:
+            break
+        # H[(c,i),(k,j)] = 1/n sum_n (p_nc delta_ck - p_nc p_nk) x_ni x_nj
+        PX = (P[:,:,None] * X1[:,None,:]).reshape(n, -1)
+        H = -PX.T.dot(PX)
+        for c in range(num_classes):
+            H[c*d:(c+1)*d, c*d:(c+1)*d] += (X1 * P[:,c:c+1]).T.dot(X1)
+        H /= n
+        H[np.diag_indices_from(H)] += ridge
+        step = np.linalg.solve(H, grad.ravel()).reshape(Wb.shape)
+        t = 1.
+        while True:
+            new_loss, new_grad, new_P = logistic_loss_grad(Wb - t * step, X1, Y, l2)
+            if new_loss <= loss - 1e-4 * t * (grad * step).sum() or t < 1e-8:
+                break
+            t /= 2
+        Wb = Wb - t * step
+        converged = loss - new_loss < tol * max(1., abs(loss))
+        loss, grad, P = new_loss, new_grad, new_P
+        if converged:
+            break
+    return Wb[:,:-1].astype(np.float32), Wb[:,-1].astype(np.float32)
+
+
+def fit_lbfgs(X, y, weight, bias, l2=1e-4, tol=1e-6, max_iter=100, device="cpu"):
+    """multinomial logistic regression by full batch L-BFGS"""
+    X = torch.from_numpy(np.asarray(X, dtype=np.float32)).to(device)
+    y = torch.from_numpy(np.asarray(y)).long().to(device)
+    W = torch.from_numpy(weight).to(device).requires_grad_()
+    b = torch.from_numpy(bias).to(device).requires_grad_()
+    opt = torch.optim.LBFGS([W, b], lr=1, max_iter=max_iter,
+                            tolerance_grad=tol, tolerance_change=tol * 1e-3, history_size=20)
+
+    def closure():
+        opt.zero_grad()
+        loss = F.cross_entropy(X.mm(W.t()) + b, y) + 0.5 * l2 * (W * W).sum()
+        loss.backward()
+        return loss
+
+    opt.step(closure)
+    return W.detach().cpu().numpy(), b.detach().cpu().numpy()
+
+
+def fit_linear_probe(linear_model, embeddings, labels, solver="lbfgs", l2=1e-4, tol=1e-6, max_iter=100, device="cpu"):
+    """fits linear_model (a LinearModel) to (N,E) embeddings and (N,) class labels in place
+
+    Starts from linear_model's current weights, so refitting after more data arrives is a warm start.
+    """
+    fc = linear_model.fc
+    weight = fc.weight.detach().cpu().numpy().astype(np.float32)
+    bias = fc.bias.detach().cpu().numpy().astype(np.float32)
+    X = np.asarray(embeddings, dtype=np.float32)
+    y = np.asarray(labels).astype(np.int64)
+    if solver == "newton":
+        weight, bias = fit_newton(X, y, weight, bias, l2=l2, tol=tol, max_iter=max_iter)
+    elif solver == "lbfgs":
+        weight, bias = fit_lbfgs(X, y, weight, bias, l2=l2, tol=tol, max_iter=max_iter, device=device)
+    else:
+        raise ValueError("unknown probe solver %s" % solver)
+    with torch.no_grad():
+        fc.weight.copy_(torch.from_numpy(weight))
+        fc.bias.copy_(torch.from_numpy(bias))
+    return linear_model
@@ -23,8 +23,8 @@ from data.setup import setup_data
 import os
 from utils import setup_args, setup_dir, setup_exp
 
-if __name__ == "__main__":
-    args = setup_args()
+def run(args):
+    """runs one experiment configured by args and returns the trainer's last logged metrics"""
     data = setup_data(args)
     experiment = setup_exp(args)
     model = setup_model(args)
@@ -49,14 +49,19 @@ if __name__ == "__main__":
         from training.control_trainer import ControlTrainer
         trainer = ControlTrainer(model, args, experiment)
     elif args.task == "viz":
-        pass
+        trainer = None
     else:
         assert False, "no other type of Trainer"
 
     if args.mode == "train":
         tr, test = data
         tr_kwargs = dict(model_dir=args.models_dir,tr_buf=tr, val_buf=test)
-        trainer.train(**tr_kwargs)
+        try:
+            trainer.train(**tr_kwargs)
+        finally:
+            # don't let stream producers outlive the run
+            for loader in data:
+                loader.close()
         
     elif args.mode == "test":
         test, = data
@@ -74,7 +79,11 @@ if __name__ == "__main__":
             encoder = model.encoder if embedder_name is not "rand_cnn" else model
             model_name = model.__class__.__name__ if embedder_name is not "rand_cnn" else "RandCNN"
             superimpose_seq_frames(encoder,model_name,test,fmap_index=fmap_index)
-        
+    return trainer.results if trainer is not None else {}
+
+
+if __name__ == "__main__":
+    run(setup_args())
 
 
 # In[ ]:
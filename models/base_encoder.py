@@ -47,6 +47,12 @@ class Encoder(nn.Module):
         embedding = raw_embedding # / raw_embedding.norm(p=2,dim=1, keepdim=True)
         return embedding
 
+    def encode_sequence(self,xs):
+        """encodes (B,T,C,H,W) frames with one forward over all B*T frames, returns (B,T,embed_len)"""
+        batch_size, num_frames = xs.shape[:2]
+        f = self.forward(xs.contiguous().view(batch_size * num_frames, *xs.shape[2:]))
+        return f.view(batch_size, num_frames, -1)
+
     
 def get_encoder(name, in_ch):
     if name == "world_models":
@@ -15,9 +15,8 @@ class InverseModel(nn.Module):
                                             out_feat=num_actions)
     
     def forward(self,xs):
-        f0 = self.encoder(xs[:,0])
-        f1 = self.encoder(xs[:,1])
-        fboth = torch.cat([f0,f1],dim=-1)
+        # [f0, f1] side by side, from one encoder pass over both frames
+        fboth = self.encoder.encode_sequence(xs[:,:2]).view(xs.shape[0],-1)
         return self.action_predictor(fboth)
     
     def loss_acc(self, trans):
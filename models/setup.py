@@ -6,13 +6,15 @@ from models.tdc import TDC
 from models.shuffle_n_learn import ShuffleNLearn
 from models.random_baselines import RawPixelsEncoder,RandomLinearProjection,RandomWeightCNN
 from models.vae import VAE
-from evaluations.infer_model import InferModel
+from evaluations.infer_model import InferModel, MultiInferModel
 from evaluations.predict_model import PredictModel
+from evaluations.control_models import ControlEvalModel
 from pathlib import Path
 from utils import get_child_dir
 import copy
 import numpy as np
 from data.env_utils.env_setup import setup_env
+from data.env_utils.get_state_params import get_nclasses_table
 
 
 def setup_model(args):
@@ -21,9 +23,11 @@ def setup_model(args):
                    "tdc": TDC}
     
     
-    env = setup_env(args)
+    env = setup_env(args.env_name, level=args.level)
     args.num_actions = env.action_space.n
+    env.close()
     del env
+    args.nclasses_table = get_nclasses_table(args.env_name, args.buckets)
     
     encoder_kwargs = dict(in_ch=3,
                           im_wh=args.resize_to,
@@ -56,8 +60,12 @@ def setup_embed_model(base_model, encoder, args):
     return base_model
 
 def setup_infer_model(base_model,encoder,args):
-    infer_model = InferModel(encoder=encoder,
-                   num_classes=args.nclasses_table[args.label_name], args=args).to(args.device)
+    if args.label_name == "all":
+        infer_model = MultiInferModel(encoder=encoder,
+                       nclasses_table=args.nclasses_table, args=args).to(args.device)
+    else:
+        infer_model = InferModel(encoder=encoder,
+                       num_classes=args.nclasses_table[args.label_name], args=args).to(args.device)
     if args.mode == "train": # linear classifier is randomly initialized here
         load_weights(infer_model.encoder, args)
     elif args.mode == "test": # linear classifier is loaded from saved weights
@@ -72,6 +80,14 @@ def setup_predict_model(base_model,encoder,args):
         load_weights(predict_model, args)        
     return predict_model
 
+def setup_control_model(base_model,encoder,args):
+    control_model = ControlEvalModel(encoder=encoder, num_actions=args.num_actions).to(args.device)
+    if args.mode == "train": # policy weights come from cma-es
+        load_weights(control_model.encoder, args)
+    elif args.mode == "test":
+        load_weights(control_model, args)
+    return control_model
+
 def load_weights(model, args):
     """This function changes the state of model or args. They are mutable"""
     weights_path = get_weights_path(args)
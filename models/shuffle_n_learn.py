@@ -1,7 +1,6 @@
 import torch
 from torch import nn
 import torch.functional as F
-import copy
 from models.base_encoder import Encoder
 from evaluations.utils import classification_acc
 import numpy as np
@@ -19,32 +18,33 @@ class ShuffleNLearn(nn.Module):
         self.num_frames = self.args.frames_per_example
     
     def forward(self,xs):
-        f = torch.cat([self.encoder(xs[:,i]) for i in range(xs.shape[1])], dim=1)
+        f = self.encoder.encode_sequence(xs).view(xs.shape[0],-1)
         return self.bin_clsf(f)
     
-    def shuffle(self,xs):
-        batch_size, num_frames_per_example = xs.shape[0], xs.shape[1]
+    def subsample(self,xs):
+        # 5 frames a,b,c,d,e spread evenly over the sequence
         assert xs.shape[1] >= 5
-        ind = torch.linspace(0,xs.shape[1] - 1,steps=5).round().long()
-        x_subsampled = torch.index_select(input=xs,dim=1,index=ind)
-        a,b,c,d,e = [x_subsampled[:,i] for i in range(5)]
-        bcd = copy.deepcopy(torch.stack((b,c,d)))
-        bad = copy.deepcopy(torch.stack((b,a,d)))
-        bed = copy.deepcopy(torch.stack((b,e,d)))
-        bcdbadbed = torch.stack((bcd,bad,bed))
+        ind = torch.linspace(0,xs.shape[1] - 1,steps=5).round().long().to(xs.device)
+        return torch.index_select(input=xs,dim=1,index=ind)
+    
+    def shuffle(self,fs):
+        """picks an ordering of the 5 subsampled embeddings fs (B,5,E) per sample with one gather:
+        bcd (0) is the correct ordering, bad and bed (1,2) are incorrect"""
+        batch_size = fs.shape[0]
+        orders = torch.tensor([[1,2,3],[1,0,3],[1,4,3]]).to(fs.device)
         probs = torch.tensor([0.5,0.25,0.25])
-        inds = torch.multinomial(input=probs, num_samples=batch_size, replacement=True)
-        shuffled_batch = torch.stack([bcdbadbed[inds[i],:,i] for i in range(batch_size) ])
-        
-        device = self.args.device  #encoder.fc.weight.device.type
-        true = (inds < 1).long().to(device) #bcd (0) is correct ordering bad and bed  (1,2) are incorrect
-        return shuffled_batch, true
+        inds = torch.multinomial(input=probs, num_samples=batch_size, replacement=True).to(fs.device)
+        order = orders[inds]
+        shuffled = torch.gather(fs, dim=1, index=order[:,:,None].expand(-1,-1,fs.shape[2]))
+        true = (inds < 1).long()
+        return shuffled, true
 
         
     def loss_acc(self, trans):
-        xs = copy.deepcopy(trans.xs)
-        x_shuff, true = self.shuffle(xs)
-        pred = self.forward(x_shuff)
+        # each subsampled frame is encoded once, the shuffles only reorder embeddings
+        fs = self.encoder.encode_sequence(self.subsample(trans.xs))
+        f_shuff, true = self.shuffle(fs)
+        pred = self.bin_clsf(f_shuff.contiguous().view(f_shuff.shape[0],-1))
         acc = classification_acc(logits=pred,true=true)
         loss = nn.CrossEntropyLoss()(pred,true)
         return loss, acc
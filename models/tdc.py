@@ -17,12 +17,16 @@ class TDC(nn.Module):
         self.num_buckets = len(self.interval_choices)
         self.temp_dist_predictor = LinearModel(in_feat=2*self.embed_len,
                                             out_feat=self.num_buckets)
+        self.all_pairs = self.args.tdc_all_pairs
+        self.pairs_per_seq = self.args.tdc_pairs_per_seq
+        self.balanced = self.args.tdc_pair_sampling == "balanced"
+        self._pair_tables = {}
     
     def forward(self,xs):
+        if self.all_pairs:
+            return self.forward_all_pairs(xs)
         x0,xt, interval_index = self.pick_frames(xs)
-        f0 = self.encoder(x0)
-        ft = self.encoder(xt)
-        fboth = torch.cat([f0,ft],dim=-1)
+        fboth = self.encoder.encode_sequence(torch.stack([x0,xt],dim=1)).view(x0.shape[0],-1)
         pred = self.temp_dist_predictor(fboth)
         true = interval_index
         return pred,true
@@ -37,6 +41,34 @@ class TDC(nn.Module):
         xt = torch.stack([xs[i,dts[i],:] for i in range(batch_size)])
         return x0,xt, torch.tensor(interval_inds).to(self.args.device)
         
+    def pair_table(self, num_frames, device):
+        """every (i, j) frame pair of a num_frames sequence whose distance j - i falls
+        in one of the interval_choices, with that interval's bucket index"""
+        key = (num_frames, str(device))
+        if key not in self._pair_tables:
+            pairs = [(i, i + dt, bucket) for bucket, interval in enumerate(self.interval_choices)
+                                         for dt in interval
+                                         for i in range(num_frames - dt)]
+            i_inds, j_inds, buckets = torch.tensor(pairs).to(device).t()
+            counts = torch.bincount(buckets, minlength=self.num_buckets).float()
+            # balanced: every bucket equally likely, like sampling a bucket and then a pair in it
+            weights = 1. / counts[buckets] if self.balanced else torch.ones(len(pairs)).to(device)
+            self._pair_tables[key] = (i_inds, j_inds, buckets, weights)
+        return self._pair_tables[key]
+    
+    def forward_all_pairs(self,xs):
+        """encodes every frame once and classifies pairs_per_seq sampled (i, j) pairs per sequence"""
+        batch_size, num_frames = xs.shape[:2]
+        fs = self.encoder.encode_sequence(xs)
+        i_inds, j_inds, buckets, weights = self.pair_table(num_frames, fs.device)
+        picks = torch.multinomial(weights, batch_size * self.pairs_per_seq, replacement=True)
+        picks = picks.view(batch_size, self.pairs_per_seq)
+        rows = torch.arange(batch_size).long().to(fs.device)[:,None]
+        fboth = torch.cat([fs[rows, i_inds[picks]], fs[rows, j_inds[picks]]], dim=-1)
+        pred = self.temp_dist_predictor(fboth.view(-1, 2*self.embed_len))
+        true = buckets[picks].view(-1)
+        return pred,true
+        
     def loss_acc(self, trans):   
         pred, true = self.forward(trans.xs)
         acc = classification_acc(logits=pred,true=true)
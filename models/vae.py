@@ -64,7 +64,7 @@ class VAE(nn.Module):
     
 
     def get_kl_rec(self,trans):
-        x = trans.xs[0]
+        x = trans.xs[:,0]
         x_hat,mu,logvar = self.forward(x)
         num_pixels = int(np.prod(x.size()[1:]))
         kldiv = -0.5 * torch.sum(1 + logvar - mu**2 - torch.exp(logvar),dim=1) / num_pixels
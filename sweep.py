@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""runs a grid of main.py configurations on one machine, without a scheduler
+
+    python sweep.py --grid '{"embedder_name": ["snl", "inv_model", "rand_cnn"], "lr": [0.001]}' \
+        --procs 4 --summary sweep.csv  --task infer --mode train --transfer_env PrivateEye-v0 ...
+
+Every argument sweep.py doesn't know is passed on to every configuration, the grid
+entries are crossed on top. Before any run starts, the episodes of each (env, level, seed)
+in the sweep are collected once in this process into the on-disk EpisodeCache, so every
+run loads them memory-mapped instead of recollecting them (not with --no_data_cache).
+Runs are spawned, not forked, so they start with a clean cuda state. The last logged value
+of every metric of every run goes to one row of the summary csv.
+"""
+from comet_ml import Experiment # comet must come before any torch modules
+import argparse
+import csv
+import json
+import queue
+import traceback
+import multiprocessing as mp
+from itertools import product
+import torch
+from utils import setup_args
+import data.setup
+
+
+def get_grid_argvs(grid, base_argv):
+    """one argv per point of grid (a dict of arg name -> list of values), appended to base_argv"""
+    names = sorted(grid)
+    argvs, configs = [], []
+    for values in product(*[grid[name] for name in names]):
+        config = dict(zip(names, values))
+        argv = list(base_argv)
+        for name, value in config.items():
+            if isinstance(value, bool): # store_true flags
+                argv += ["--" + name] if value else []
+            elif isinstance(value, (list, tuple)):
+                argv += ["--" + name] + [str(v) for v in value]
+            else:
+                argv += ["--" + name, str(value)]
+        argvs.append(argv)
+        configs.append(config)
+    return argvs, configs
+
+
+def get_corpus_key(args):
+    return (args.env_name, args.level, args.seed)
+
+
+def prepare_data(all_args):
+    """collects the episodes every run needs into the episode cache, once per (env, level, seed)"""
+    for args in all_args:
+        if args.stream or args.no_data_cache:
+            continue # streams collect in their own producer processes
+        setup_dataset_fn = getattr(data.setup, "setup_" + args.mode + "_data")
+        setup_dataset_fn(args)
+    # the runs load the episodes from the cache, this process doesn't need them anymore
+    data.setup._corpora.clear()
+
+
+def _run_config(index, argv, num_threads, gpu, results_queue):
+    from main import run
+    torch.set_num_threads(num_threads)
+    if gpu is not None:
+        torch.cuda.set_device(gpu)
+    try:
+        results = run(setup_args(argv))
+        results_queue.put((index, results, None))
+    except Exception:
+        traceback.print_exc()
+        results_queue.put((index, {}, traceback.format_exc().strip().split("\n")[-1]))
+
+
+def run_sweep(argvs, num_procs):
+    """runs every argv in its own spawned process, at most num_procs at a time, spread over the gpus.
+    Returns one (results, error) per argv"""
+    # spawn: a child forked after this process touched cuda (setup_args does) can't initialize it
+    ctx = mp.get_context("spawn")
+    results_queue = ctx.Queue()
+    num_threads = max(1, mp.cpu_count() // num_procs)
+    num_gpus = torch.cuda.device_count()
+    outcomes = [None] * len(argvs)
+    running = {}
+    next_index = 0
+
+    def record(index, results, error):
+        outcomes[index] = (results, error)
+        p = running.pop(index, None)
+        if p is not None:
+            p.join()
+        print("finished %i/%i: %s" % (sum(o is not None for o in outcomes), len(argvs), " ".join(argvs[index])))
+
+    while next_index < len(argvs) or running:
+        while next_index < len(argvs) and len(running) < num_procs:
+            gpu = next_index % num_gpus if num_gpus > 0 else None
+            # not a Pool: its daemonic workers couldn't start DataLoader workers of their own
+            p = ctx.Process(target=_run_config, args=(next_index, argvs[next_index], num_threads, gpu, results_queue))
+            p.start()
+            running[next_index] = p
+            next_index += 1
+        try:
+            record(*results_queue.get(timeout=30))
+        except queue.Empty:
+            # a run that died without reporting (e.g. killed) would otherwise be waited on forever.
+            # A run that exited normally since the timeout has its result in the queue already
+            dead = [index for index, p in running.items() if not p.is_alive()]
+            if dead:
+                try:
+                    while True:
+                        record(*results_queue.get_nowait())
+                except queue.Empty:
+                    pass
+            for index in dead:
+                if index in running:
+                    record(index, {}, "exited with code %s" % running[index].exitcode)
+    return outcomes
+
+
+def write_summary(path, configs, outcomes):
+    config_names = sorted(set(k for config in configs for k in config))
+    metric_names = sorted(set(k for results, _ in outcomes for k in results))
+    with open(path, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=config_names + metric_names + ["error"])
+        writer.writeheader()
+        for config, (results, error) in zip(configs, outcomes):
+            row = dict(config)
+            row.update(results)
+            row["error"] = error or ""
+            writer.writerow(row)
+    print("summary: %s" % path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid", type=str, required=True) # json dict of arg name -> list of values
+    parser.add_argument("--procs", type=int, default=None) # runs at once, defaults to one per gpu or to cpus // 4
+    parser.add_argument("--summary", type=str, default="sweep_summary.csv")
+    sweep_args, base_argv = parser.parse_known_args()
+    grid = json.loads(sweep_args.grid)
+
+    argvs, configs = get_grid_argvs(grid, base_argv)
+    all_args = [setup_args(argv) for argv in argvs]
+    print("%i configurations over %i data corpora" % (len(argvs), len(set(map(get_corpus_key, all_args)))))
+    prepare_data(all_args)
+
+    num_procs = sweep_args.procs
+    if num_procs is None:
+        num_procs = torch.cuda.device_count() or max(1, mp.cpu_count() // 4)
+    outcomes = run_sweep(argvs, num_procs)
+    write_summary(sweep_args.summary, configs, outcomes)
@@ -14,6 +14,8 @@ class BaseTrainer(object):
         self.max_epochs = 10000
         self.last_epoch_logged = 0
         self.label_name = self.args.label_name
+        # last value logged for each metric, e.g. for a sweep's summary table
+        self.results = {}
         
         print("%s, %s"%(args.mode, args.task))
         if self.args.needs_labels:
@@ -45,6 +47,7 @@ class BaseTrainer(object):
             
             
         if isinstance(value,dict):
+            self.results.update({"%s_%s"%(key,k): v for k,v in value.items()})
             self.experiment.log_metrics(dic=value,prefix=key, step=self.epoch)
             print("\t\t%s: "%(key))
             for k,v in value.items():
@@ -54,6 +57,7 @@ class BaseTrainer(object):
                 
                 
         else:
+            self.results[key] = value
             self.printkv(key,value)
             self.experiment.log_metric(name=key,value=value, step=self.epoch)
 
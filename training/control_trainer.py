@@ -1,10 +1,14 @@
 from evaluations.control_models import ControlEvalModel
-import gym
-from data.utils import convert_frame
+from data.utils import convert_frame, derive_seed
+from data.preprocess import preprocess_frames
+from contextlib import ExitStack
+from data.env_utils.env_pool import get_env_pool
 from training.base_trainer import BaseTrainer
 from functools import partial
 import copy
+import multiprocessing as mp
 import numpy as np
+import torch
 from cma import CMAEvolutionStrategy
 
 class ControlTrainer(BaseTrainer):
@@ -15,6 +19,7 @@ class ControlTrainer(BaseTrainer):
         self.model = model
         self.encoder = self.model.encoder
         self.args = args
+        self.evaluator = PopulationEvaluator(self.encoder, args, num_workers=args.workers)
 
 
     def setup(self):
@@ -31,48 +36,174 @@ class ControlTrainer(BaseTrainer):
     def train(self, model_dir, tr_buf=None,val_buf=None):
         evaluate = partial(base_evaluate,encoder=self.encoder, args=self.args)
         prev_best = np.inf
-        for epoch in range(self.max_epochs):
-            params_set, fitnesses = self.es.ask_and_eval(evaluate)
-            self.es.tell(params_set,fitnesses)
-            best_params, best_fitness, _ = self.es.best.get()
-            if best_fitness < prev_best:
-                best_ctlr = ctlr = ControlEvalModel(encoder=self.encoder,
-                        num_actions=self.args.num_actions,
-                        parameters=best_params).to(self.args.device)
-                self.save_model(best_ctlr, 
-                                model_dir,
-                                "best_model_%f.pt"% -best_fitness )
-                print("new tr_best: ", -best_fitness)
-                try:
-                    self.experiment.log_metric(-best_fitness,"tr_overall_best")
-                except:
-                    pass
+        finished = False
+        try:
+            for epoch in range(self.max_epochs):
+                self.epoch = epoch + 1
+                params_set = self.es.ask()
+                fitnesses = self.evaluator(params_set)
+                self.es.tell(params_set,fitnesses)
+                best_params, best_fitness, _ = self.es.best.get()
+                if best_fitness < prev_best:
+                    best_ctlr = ctlr = ControlEvalModel(encoder=self.encoder,
+                            num_actions=self.args.num_actions,
+                            parameters=best_params).to(self.args.device)
+                    self.save_model(best_ctlr, 
+                                    model_dir,
+                                    "best_model_%f.pt"% -best_fitness )
+                    print("new tr_best: ", -best_fitness)
+                    prev_best = copy.deepcopy(best_fitness)
                 
-                prev_best = copy.deepcopy(best_fitness)
-                
-            best, worst, mean = -np.min(fitnesses),\
-                                -np.max(fitnesses),\
-                                -np.mean(fitnesses)
-            try:
-                self.experiment.log_multiple_metrics(dict(best=best,
-                                             worst=worst,
-                                             mean=mean),
-                                        prefix="train",
-                                        step=epoch)
-            except:
-                pass
-
-            if epoch % self.args.eval_best_freq == 0:
-                best_avg, best_dist = evaluate(parameters=best_params,
-                                                        negative_reward=False,dist=True)
-                print("val_best", best_avg)
-                try:
-                    self.experiment.log_metric(best_avg,"val_best", step=epoch)
-                except:
-                    pass
+                best, worst, mean = -np.min(fitnesses),\
+                                    -np.max(fitnesses),\
+                                    -np.mean(fitnesses)
+                self.log_metric(key="tr_overall_best",value=-best_fitness)
+                self.log_metric(key="train",value=dict(best=best,
+                                                       worst=worst,
+                                                       mean=mean,
+                                                       rollouts=self.evaluator.num_rollouts_played))
+
+                if epoch % self.args.eval_best_freq == 0:
+                    best_avg, best_dist = evaluate(parameters=best_params,
+                                                            negative_reward=False,dist=True)
+                    self.log_metric(key="val_best",value=best_avg)
+            finished = True
+        finally:
+            # also on an exception or ctrl-c, so no rollout worker or emulator outlives training.
+            # Workers may then be mid-rollout, so they are terminated rather than waited for
+            self.evaluator.close(terminate=not finished)
+            get_env_pool().close_all()
                 
                 
                 
+class PopulationEvaluator(object):
+    """evaluates a generation of cma-es candidates on a pool of rollout processes
+
+    Every worker holds a cpu copy of the frozen encoder, made once when the pool starts on the first call, and
+    reuses the envs of its own EnvPool, so only the flat parameter vectors go out and fitnesses come back.
+    num_workers=0 evaluates in this process.
+    """
+    def __init__(self, encoder, args, num_workers):
+        self.encoder = encoder
+        self.args = args
+        self.num_workers = num_workers
+        self.pool = None
+        self.num_rollouts_played = 0
+
+    def start_pool(self):
+        # started on the first generation, a trainer that never trains never forks workers
+        if self.num_workers > 0 and self.pool is None:
+            worker_args = copy.copy(self.args)
+            worker_args.device = "cpu"
+            worker_encoder = copy.deepcopy(self.encoder).cpu().eval()
+            for p in worker_encoder.parameters():
+                p.requires_grad = False
+            # forked, so the encoder is inherited rather than pickled per task
+            self.pool = mp.get_context("fork").Pool(self.num_workers,
+                                                    initializer=_init_rollout_worker,
+                                                    initargs=(worker_encoder, worker_args))
+
+    def __call__(self, params_set):
+        self.start_pool()
+        if self.args.rollout_schedule == "halving":
+            fitnesses = self.evaluate_halving(params_set)
+        elif self.args.lockstep_envs > 0:
+            fitnesses = self.evaluate_lockstep(params_set)
+        elif self.pool is None:
+            fitnesses = [base_evaluate(parameters, args=self.args, encoder=self.encoder) for parameters in params_set]
+        else:
+            fitnesses = self.pool.map(_evaluate_in_worker, [np.asarray(p) for p in params_set], chunksize=1)
+        if self.args.rollout_schedule != "halving":
+            self.num_rollouts_played = len(params_set) * self.args.rollouts
+        return fitnesses
+
+    def play(self, params_set, jobs):
+        """reward of every (candidate, rollout) job, in groups of lockstep_envs envs stepped together"""
+        # retro allows one emulator per process, so its envs can't be stepped together
+        group_size = 1 if self.args.retro else max(self.args.lockstep_envs, 1)
+        groups = [jobs[i:i + group_size] for i in range(0, len(jobs), group_size)]
+        tasks = [([np.asarray(params_set[c]) for c, _ in group],
+                  [get_rollout_seed(self.args, r) for _, r in group]) for group in groups]
+        if self.pool is None:
+            group_rewards = [lockstep_rollouts(params_list, self.args, self.encoder, seeds) for params_list, seeds in tasks]
+        else:
+            group_rewards = self.pool.map(_lockstep_in_worker, tasks, chunksize=1)
+        return [reward for rewards in group_rewards for reward in rewards]
+
+    def evaluate_lockstep(self, params_set):
+        """plays every (candidate, rollout) episode of the generation with play"""
+        jobs = [(c, r) for c in range(len(params_set)) for r in range(self.args.rollouts)]
+        reward_sums = np.zeros(len(params_set))
+        for (c, _), reward in zip(jobs, self.play(params_set, jobs)):
+            reward_sums[c] += reward
+        # negative, cma-es minimizes
+        return list(-reward_sums / self.args.rollouts)
+
+    def evaluate_halving(self, params_set):
+        """successive halving over the rollout budget
+
+        Every candidate first gets halving_min_rollouts rollouts. Each round then keeps the
+        top halving_keep fraction by mean reward and doubles their rollouts, up to args.rollouts,
+        so most of the budget goes to the candidates that could still rank at the top.
+        Candidates kept for more rounds rank above every one cut earlier, which is all cma-es
+        uses; the returned values are the negative mean rewards, raised where needed to keep that order.
+        """
+        num_candidates = len(params_set)
+        rewards = [[] for _ in range(num_candidates)]
+        rounds_survived = np.zeros(num_candidates)
+        alive = list(range(num_candidates))
+        num_rollouts = min(self.args.halving_min_rollouts, self.args.rollouts)
+        while True:
+            jobs = [(c, r) for c in alive for r in range(len(rewards[c]), num_rollouts)]
+            for (c, _), reward in zip(jobs, self.play(params_set, jobs)):
+                rewards[c].append(reward)
+            if num_rollouts >= self.args.rollouts or len(alive) == 1:
+                break
+            num_keep = max(1, int(np.ceil(self.args.halving_keep * len(alive))))
+            alive = sorted(alive, key=lambda c: -np.mean(rewards[c]))[:num_keep]
+            rounds_survived[alive] += 1
+            num_rollouts = min(2 * num_rollouts, self.args.rollouts)
+
+        order = sorted(range(num_candidates), key=lambda c: (-rounds_survived[c], -np.mean(rewards[c])))
+        fitnesses = np.zeros(num_candidates)
+        prev = -np.inf
+        for c in order:
+            fitnesses[c] = prev = max(-np.mean(rewards[c]), prev)
+        self.num_rollouts_played = sum(len(r) for r in rewards)
+        return list(fitnesses)
+
+    def close(self, terminate=False):
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+_worker_encoder = None
+_worker_args = None
+
+def _init_rollout_worker(encoder, args):
+    global _worker_encoder, _worker_args
+    torch.set_num_threads(1)
+    _worker_encoder = encoder
+    _worker_args = args
+
+def _evaluate_in_worker(parameters):
+    return base_evaluate(parameters, args=_worker_args, encoder=_worker_encoder)
+
+def _lockstep_in_worker(task):
+    params_list, seeds = task
+    return lockstep_rollouts(params_list, _worker_args, _worker_encoder, seeds)
+
+
+def get_rollout_seed(args, rollout):
+    # with --rollout_seed every candidate plays the same episodes
+    return derive_seed(args.rollout_seed, rollout) if args.rollout_seed is not None else None
+
+
 def base_evaluate(parameters,args, encoder,
                   negative_reward=True, dist=False):
 
@@ -81,9 +212,10 @@ def base_evaluate(parameters,args, encoder,
                         num_actions=args.num_actions,
                         parameters=parameters).to(args.device)
     solution_rewards = []
-    for _ in range(args.rollouts):
+    for rollout in range(args.rollouts):
         reward_sum = do_rollout(ctlr=ctlr,
-                                args=args)
+                                args=args,
+                                seed=get_rollout_seed(args, rollout))
         if negative_reward: # for cases where the cma-es library minimizes
             reward_sum = - reward_sum
         solution_rewards.append(reward_sum) 
@@ -93,19 +225,60 @@ def base_evaluate(parameters,args, encoder,
     else:
         return avg_rew
 
-def do_rollout(ctlr,args):
-    env = gym.make(args.env_name)
-    done= False
-    reward_sum = 0.
-    state = env.reset()
-    _ = env.render("rgb_array")     # render must come after reset
-    while not done:
-        x = convert_frame(state,to_tensor=True,
-                              resize_to=args.resize_to)
-
-        x = x[None,:]
-        
-        a = ctlr(x)
-        state,reward,done,_ = env.step(a.data)
-        reward_sum += reward
-    return reward_sum
\ No newline at end of file
+def do_rollout(ctlr,args,seed=None):
+    with get_env_pool().checkout(args.env_name, level=args.level, seed=seed) as env:
+        done= False
+        reward_sum = 0.
+        state, _ = env.reset()
+        _ = env.render("rgb_array")     # render must come after reset
+        while not done:
+            x = convert_frame(state,to_tensor=True,
+                                  resize_to=args.resize_to)
+
+            x = x[None,:].to(args.device)
+            
+            a = ctlr(x)
+            state,reward,done,_ = env.step(int(a[0]))
+            reward_sum += reward
+    return reward_sum
+
+
+def lockstep_rollouts(params_list, args, encoder, seeds=None):
+    """plays one episode per parameter vector in params_list, with all the envs stepped together
+
+    Every step, the frames of the envs still playing are converted as one batch and go through
+    a single encoder forward; each env's candidate linear policy is then applied to its own
+    embedding with one bmm. Finished envs are masked out until every episode is done.
+    Returns the (K,) reward sums.
+    """
+    num_envs = len(params_list)
+    seeds = seeds if seeds is not None else [None] * num_envs
+    num_weights = args.num_actions * encoder.embed_len
+    params = torch.from_numpy(np.stack(params_list).astype(np.float32)).to(args.device)
+    weights = params[:, :num_weights].contiguous().view(num_envs, args.num_actions, encoder.embed_len)
+    biases = params[:, num_weights:]
+
+    reward_sums = np.zeros(num_envs)
+    done = np.zeros(num_envs, dtype=bool)
+    pool = get_env_pool()
+    with ExitStack() as stack:
+        envs = [stack.enter_context(pool.checkout(args.env_name, level=args.level, seed=seed)) for seed in seeds]
+        states = []
+        for env in envs:
+            state, _ = env.reset()
+            _ = env.render("rgb_array")     # render must come after reset
+            states.append(state)
+        with torch.no_grad():
+            while not done.all():
+                active = np.flatnonzero(~done)
+                x = preprocess_frames(np.stack([states[i] for i in active]),
+                                      resize_to=args.resize_to,
+                                      device=args.device)
+                f = encoder(x)
+                inds = torch.from_numpy(active).to(args.device)
+                logits = torch.bmm(weights[inds], f[:,:,None]).squeeze(2) + biases[inds]
+                actions = torch.argmax(logits, dim=1).cpu().numpy()
+                for i, a in zip(active, actions):
+                    states[i], reward, done[i], _ = envs[i].step(int(a))
+                    reward_sums[i] += reward
+    return reward_sums
@@ -7,17 +7,27 @@ import os
 from training.base_trainer import BaseTrainer
 from evaluations.pca_corr_model import compute_pca_corr
 from evaluations.fmap_superimpose import superimpose_fmaps
+from evaluations.embedding_cache import EmbeddingCache, extract_embeddings
+from evaluations.probe_solver import fit_linear_probe
 
 class InferenceTrainer(BaseTrainer):
     def __init__(self, model, args, experiment):
         super(InferenceTrainer, self).__init__(model, args, experiment)
         self.opt = Adam(params=self.model.parameters(),lr=self.args.lr)
+        # --label_name all probes every label of the env at once, with one head per label
+        self.multi_label = self.args.task == "infer" and self.label_name == "all"
+        self.label_names = sorted(self.args.nclasses_table) if self.multi_label else [self.label_name]
 
 
     def one_iter(self, trans, update_weights=True):
         if update_weights:
             self.opt.zero_grad()
         loss, acc = self.model.loss_acc(trans)
+        if isinstance(loss, dict): # one loss per label, the heads share the backward
+            if update_weights:
+                sum(loss.values()).backward()
+                self.opt.step()
+            return {k: float(v.data) for k, v in loss.items()}, acc
         if update_weights:
             loss.backward()
             self.opt.step()
@@ -37,6 +47,13 @@ class InferenceTrainer(BaseTrainer):
             accs.append(acc)
         
 
+        if isinstance(losses[0], dict):
+            avg_loss = {k: np.mean([l[k] for l in losses]) for k in losses[0]}
+            avg_acc = {k: np.mean([a[k] for a in accs]) for k in accs[0]}
+            self.log_metric(key = mode + "_loss",value=avg_loss)
+            self.log_metric(key=mode + "_acc",value={k: 100*v for k, v in avg_acc.items()})
+            return sum(avg_loss.values()), avg_acc
+
         avg_loss = np.mean(losses)
         
         self.log_metric(key = mode + "_loss",value=avg_loss)
@@ -45,21 +62,60 @@ class InferenceTrainer(BaseTrainer):
             self.log_metric(key=mode + "_acc",value=100*avg_acc)
         return avg_loss, avg_acc
 
-    def do_pca_corr(self,test_set, encoder):
-        all_fs, all_ys = self.collect_embeddings_megabatch(test_set, encoder)
-        sp_corr, evr = compute_pca_corr(embeddings=all_fs, labels=all_ys)
+    @property
+    def uses_embedding_cache(self):
+        return self.args.task == "infer" and (self.args.precompute_embeddings
+                                              or self.args.probe_solver != "sgd"
+                                              or self.multi_label)
+
+    def get_embedding_out_dir(self, name):
+        if self.args.embedding_cache_dir is None:
+            return None
+        return Path(self.args.embedding_cache_dir) / self.args.exp_id / name
+
+    def precompute_embeddings(self, buffer, name, shuffle=True):
+        return EmbeddingCache(buffer, self.model.encoder,
+                              batch_size=self.args.batch_size,
+                              device=self.args.device,
+                              out_dir=self.get_embedding_out_dir(name),
+                              shuffle=shuffle)
+
+    def do_pca_corr(self,test_set, encoder, cache=None):
+        if cache is None:
+            all_fs, all_ys = self.collect_embeddings_megabatch(test_set, encoder)
+            sp_corr, evr = compute_pca_corr(embeddings=all_fs, labels=all_ys)
+            self.log_metric(key="evr",value=evr)
+            self.log_metric(key="spearman_corr",value=sp_corr)
+            return
         
+        # the components are fit once, streaming over the (possibly memory-mapped) cache
+        sp_corrs, evr = compute_pca_corr(embeddings=cache.embeddings,
+                                         labels={k: cache.labels[k] for k in self.label_names})
+        for label_name, sp_corr in sp_corrs.items():
+            suffix = "_" + label_name if self.multi_label else ""
+            self.log_metric(key="spearman_corr" + suffix,value=sp_corr)
         self.log_metric(key="evr",value=evr)
-        self.log_metric(key="spearman_corr",value=sp_corr)
         
     
     def test(self,test_set):
-        self.do_pca_corr(test_set, self.model.encoder)
-        self.one_epoch(test_set,mode="test")        
+        if self.uses_embedding_cache:
+            test_cache = self.precompute_embeddings(test_set, "test", shuffle=False)
+            self.do_pca_corr(test_set, self.model.encoder, cache=test_cache)
+            self.one_epoch(test_cache,mode="test")
+        else:
+            self.do_pca_corr(test_set, self.model.encoder)
+            self.one_epoch(test_set,mode="test")        
         superimpose_fmaps(self.model.encoder, test_set, self.experiment)
 
         
     def train(self, model_dir, tr_buf, val_buf):
+        if self.uses_embedding_cache:
+            # the encoder is frozen, so embed everything once and train the probe on that
+            tr_buf = self.precompute_embeddings(tr_buf, "tr")
+            val_buf = self.precompute_embeddings(val_buf, "val", shuffle=False)
+            if self.args.probe_solver != "sgd":
+                self.fit_probe(model_dir, tr_buf, val_buf)
+                return
         best_val_loss = np.inf
         while self.epoch < self.max_epochs:
             self.epoch+=1
@@ -72,18 +128,28 @@ class InferenceTrainer(BaseTrainer):
                 self.replace_best_model(model_dir)
                 self.save_model(self.model, model_dir, "best_model_%f.pt"%best_val_loss)
                 
-    def collect_embeddings_megabatch(self,test_set, encoder):
-        fs = []
-        ys = []
-        for trans in test_set:
-            x1 = trans.xs[:,0]
-            f = encoder(x1)
-            fs.append(f)
-
-            y = trans.state_param_dict[self.label_name]
-            ys.append(copy.deepcopy(y[:,0]))
+    def fit_probe(self, model_dir, tr_cache, val_cache):
+        """solves for the linear probe on the cached train embeddings in one full batch fit"""
+        self.epoch += 1
+        heads = self.model.linear_models if self.multi_label else {self.label_name: self.model.linear_model}
+        for label_name, head in heads.items():
+            fit_linear_probe(head,
+                             tr_cache.embeddings,
+                             tr_cache.labels[label_name],
+                             solver=self.args.probe_solver,
+                             l2=self.args.probe_l2,
+                             tol=self.args.probe_tol,
+                             max_iter=self.args.probe_max_iter,
+                             device=self.args.device)
+        self.one_epoch(tr_cache,mode="train_eval")
+        val_loss, _ = self.one_epoch(val_cache,mode="val")
+        self.save_model(self.model, model_dir, "cur_model.pt" )
+        self.replace_best_model(model_dir)
+        self.save_model(self.model, model_dir, "best_model_%f.pt"%val_loss)
 
-        f = torch.cat(fs)
-        y = torch.cat(ys).squeeze()
-        return f.detach(), y
-                
+    def collect_embeddings_megabatch(self,test_set, encoder):
+        fs, ys = extract_embeddings(test_set,
+                                    embed_fn=lambda trans: encoder(trans.xs[:,0]),
+                                    label_fn=lambda trans: {self.label_name: trans.state_param_dict[self.label_name][:,0]},
+                                    out_dir=self.get_embedding_out_dir("pca"))
+        return torch.from_numpy(fs), torch.from_numpy(ys[self.label_name])
@@ -1,6 +1,6 @@
 from training.inference_trainer import InferenceTrainer
-import copy
 import torch
+from evaluations.embedding_cache import extract_embeddings
 
 class PredictionTrainer(InferenceTrainer):
     def __init__(self, model, args, experiment):
@@ -12,21 +12,14 @@ class PredictionTrainer(InferenceTrainer):
         self.do_pca_corr(test_set, self.model)
         
     def collect_embeddings_megabatch(self,test_set, encoder):
-        fs = []
-        ys = []
-        for trans in test_set:
+        def embed_fn(trans):
             f = encoder(trans)
-            frs = f.reshape(f.shape[0]*f.shape[1],f.shape[2])
-            fs.append(frs)
-            
+            return f.reshape(f.shape[0]*f.shape[1],f.shape[2])
+
+        def label_fn(trans):
             # we don't predict the first frame, so don't include the first frame's y info 
             y = trans.state_param_dict[self.label_name][:,1:] 
-            yrs = y.reshape(y.shape[0]*y.shape[1])
-
-            ys.append(yrs)
+            return {self.label_name: y.reshape(y.shape[0]*y.shape[1])}
 
-        f = torch.cat(fs)
-        y = torch.cat(ys).squeeze()
-        return f.detach(), y
-        
-    
\ No newline at end of file
+        fs, ys = extract_embeddings(test_set, embed_fn, label_fn, out_dir=self.get_embedding_out_dir("pca"))
+        return torch.from_numpy(fs), torch.from_numpy(ys[self.label_name])
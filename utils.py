@@ -14,6 +14,7 @@ import random
 import argparse
 import copy
 import uuid
+import multiprocessing as mp
 #import retro
 
 def setup_exp(args):
@@ -47,8 +48,9 @@ def setup_dir(args,exp_id,basename=".models"):
 
 
 
-def setup_args():
-    test_notebook= True if "ipykernel_launcher" in sys.argv[0] else False
+def setup_args(argv=None):
+    """parses argv (sys.argv[1:] when None), so runs can also be configured in process, e.g. by sweep.py"""
+    test_notebook= True if "ipykernel_launcher" in sys.argv[0] and argv is None else False
     tmp_argv = copy.deepcopy(sys.argv)
     if test_notebook:
         sys.argv = [""]
@@ -83,6 +85,9 @@ def setup_args():
     # embedder specific args
     parser.add_argument("--num_time_dist_buckets",default=4)
     parser.add_argument("--seq_tasks_num_frames",default=10)
+    parser.add_argument("--tdc_all_pairs",action="store_true") # many (i,j) pairs per sequence from one encoder pass
+    parser.add_argument("--tdc_pairs_per_seq",type=int,default=16)
+    parser.add_argument("--tdc_pair_sampling",choices=["balanced","uniform"],default="balanced")
     
     
     
@@ -94,10 +99,23 @@ def setup_args():
     parser.add_argument("--val_size",type=int,default=1000)
     parser.add_argument("--test_size",type=int,default=1000)
     parser.add_argument("--episode_max_frames", type=int, default=500)
+    parser.add_argument("--collect_workers",type=int,default=0) # 0 collects episodes in the main process
+    parser.add_argument("--data_cache_dir",type=str,default=".data_cache")
+    parser.add_argument("--no_data_cache",action="store_true")
+    parser.add_argument("--frame_store",choices=["array","compressed"],default="array")
+    parser.add_argument("--frame_chunk_size",type=int,default=32)
+    parser.add_argument("--frame_cache_mb",type=int,default=256) # per DataLoader worker
+    parser.add_argument("--stream",action="store_true") # train on episodes generated while training
+    parser.add_argument("--stream_capacity",type=int,default=20000) # max frames held by the replay buffer
+    parser.add_argument("--stream_min_frames",type=int,default=1000)
+    parser.add_argument("--stream_buffer",choices=["fifo","reservoir"],default="fifo")
     
     
     #general params
     parser.add_argument("--num_workers",type=int,default=4)
+    parser.add_argument("--share_memory",action="store_true") # put collected arrays in memory-mapped files so DataLoader workers attach instead of copying
+    parser.add_argument("--shared_memory_dir",type=str,default="/dev/shm") # where --share_memory puts them
+    parser.add_argument("--prefetch",type=int,default=2) # batches moved to device ahead of time, 0 to disable
     parser.add_argument("--no_actions",action="store_true")
     parser.add_argument("--comet_mode",type=str, choices=["online", "offline"],default="online")
     
@@ -107,15 +125,27 @@ def setup_args():
     parser.add_argument("--batch_size",type=int,default=32)
     parser.add_argument("--epochs",type=int,default=10000)
     parser.add_argument("--buckets",type=int,default=16)
-    parser.add_argument("--label_name",type=str,default="x_coord")
+    parser.add_argument("--label_name",type=str,default="x_coord") # "all" probes every label of the env in one run
+    parser.add_argument("--precompute_embeddings",action="store_true") # embed the data once, then train the probe on the cached embeddings
+    parser.add_argument("--embedding_cache_dir",type=str,default=None) # memory-map the cached embeddings under here instead of keeping them in RAM
+    parser.add_argument("--probe_solver",type=str,default="sgd",choices=["sgd","lbfgs","newton"]) # lbfgs/newton fit the infer probe in one full batch solve on precomputed embeddings
+    parser.add_argument("--probe_l2",type=float,default=1e-4)
+    parser.add_argument("--probe_tol",type=float,default=1e-6)
+    parser.add_argument("--probe_max_iter",type=int,default=100)
   
 
     # prediction parameters
     parser.add_argument("--pred_num_params", type=int, default=10)
 
     # control args
-    parser.add_argument("--rollouts",type=str,default=10)
-    parser.add_argument("--val_rollouts",type=str,default=5)
+    parser.add_argument("--rollouts",type=int,default=10)
+    parser.add_argument("--val_rollouts",type=int,default=5)
+    parser.add_argument("--rollout_seed",type=int,default=None) # seeds rollout i of every candidate with the same seed
+    parser.add_argument("--lockstep_envs",type=int,default=0) # > 0 steps up to this many rollouts together with one batched encoder forward per step
+    parser.add_argument("--rollout_schedule",type=str,default="fixed",choices=["fixed","halving"]) # halving spends the rollouts on the candidates that could still rank at the top
+    parser.add_argument("--halving_min_rollouts",type=int,default=2)
+    parser.add_argument("--halving_keep",type=float,default=0.5) # fraction of candidates kept each halving round
+    parser.add_argument("--workers",type=int,default=max(mp.cpu_count() - 1, 1)) # rollout processes, the cma-es population is workers + 1
     parser.add_argument("--eval_best_freq",type=int,default=5)
     
     
@@ -128,7 +158,7 @@ def setup_args():
     parser.add_argument("--model_type",type=str,default="classifier")
 
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     args.test_notebook = test_notebook
     if args.test_notebook:
         args.workers=1
@@ -214,6 +244,13 @@ def setup_args():
     if args.mode == "viz":
         args.frames_per_example = args.viz_num_frames
     print("num_frames_per_example",args.frames_per_example)
+    # the embedding cache is sized from the dataset, a stream has no fixed set of examples to embed
+    assert not (args.stream and (args.precompute_embeddings or args.probe_solver != "sgd" or args.label_name == "all")),\
+        "--stream can't be combined with --precompute_embeddings, --probe_solver lbfgs/newton or --label_name all"
+    if args.frames_per_example is not None: # control builds no EnvDataset and never sets it
+        window_len = (args.frames_per_example - 1) * args.stride + 1
+        assert args.episode_max_frames == -1 or args.episode_max_frames >= window_len,\
+            "episode_max_frames %i can't hold a window of %i frames" % (args.episode_max_frames, window_len)
     if args.small_scale:
         args.batch_size = 8  
         args.tr_size = 64